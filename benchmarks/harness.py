@@ -0,0 +1,148 @@
+"""
+Throughput benchmarks for BlockGenerator.generate_blocks
+
+Run from the repository root:
+    python -m benchmarks.harness                   Run the default cases and compare against the baselines
+    python -m benchmarks.harness large --save      Run a case and store its results as the new baseline
+    python -m benchmarks.harness --stages          Also break the cases down per stage, in a separate run
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+from time import perf_counter
+from collections import OrderedDict
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+CASES = OrderedDict([
+    ('small', {'rows': 10000}),
+    ('medium', {'rows': 100000}),
+    ('medium_sharded', {'rows': 100000, 'workers': 4}),
+    ('large', {'rows': 1000000}),
+    ('large_sharded', {'rows': 1000000, 'workers': 4}),
+])
+DEFAULT_CASES = ['small', 'medium', 'medium_sharded']
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+
+def peak_rss():
+    """Peak resident set size of this process in MB, None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)  # Bytes on macOS, else kB
+
+
+def run_case(spec, directory, instrument=False):
+    """
+    Generate a workspace for a case and time generate_blocks on it, in a fresh process.
+
+    The stage timers cost about a fifth of the throughput, so only an instrumented run reports stages, and its time
+    is not comparable to the baselines.
+    """
+    sys.path.insert(0, os.getcwd())
+    from benchmarks.synthetic import make_workspace
+    from mods.blockgenerator import BlockGenerator
+
+    files = make_workspace(directory, spec['rows'], spec.get('nodes', 8),
+                           irrelevant_ratio=spec.get('irrelevant_ratio', 0.1), seed=spec.get('seed', 0))
+
+    generator = BlockGenerator()
+    for key in ('code_path', 'opc_path', 'deviations_file', 'relevant_blocks_file', 'relevant_nodes_file',
+                'output_path'):
+        setattr(generator, key, files[key])
+    generator.workers = spec.get('workers', 0)
+    generator.instrument = instrument
+    start = perf_counter()
+    generator.generate_blocks(files['taglist'])
+    elapsed = perf_counter() - start
+
+    result = {'rows': spec['rows'],
+              'rows_per_sec': spec['rows'] / elapsed,
+              'peak_rss_mb': peak_rss()}
+    if instrument:
+        result['stages'] = OrderedDict((stage, t) for stage, t in generator.stats.times.items() if t)
+        result['stages']['total'] = elapsed
+    return result
+
+
+def run_isolated(spec, instrument=False):
+    """Run a case in a fresh process and a fresh workspace, so peak RSS and outputs are not carried over"""
+    directory = tempfile.mkdtemp(prefix='blockgen_bench_')
+    try:
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+            return pool.submit(run_case, spec, directory, instrument).result()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def read_baselines(file):
+    if not os.path.isfile(file):
+        return {}
+    with open(file, 'r') as f:
+        return json.load(f)
+
+
+def compare(result, baseline, tolerance):
+    """Describe a result relative to its baseline, and whether it is a regression"""
+    if baseline is None:
+        return 'no baseline', False
+    change = result['rows_per_sec'] / baseline['rows_per_sec'] - 1
+    return '{:+.1%}'.format(change), change < -tolerance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.harness',
+                                     description='Benchmark BlockGenerator on synthetic taglists')
+    parser.add_argument('cases', nargs='*', help='Cases to run: {} (default: {})'
+                        .format(', '.join(CASES), ', '.join(DEFAULT_CASES)))
+    parser.add_argument('--baselines', default=BASELINE_FILE, help='Baseline file')
+    parser.add_argument('--save', action='store_true', help='Store the results as new baselines')
+    parser.add_argument('--stages', action='store_true',
+                        help='Time every stage in an extra, instrumented run per case (not used for the comparison)')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed throughput drop before a case counts as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    names = args.cases or DEFAULT_CASES
+    for name in names:
+        if name not in CASES:
+            parser.error('Unknown case {}'.format(name))
+
+    baselines = read_baselines(args.baselines)
+    regressions = []
+    print('{:<16}{:>10}{:>12}{:>10}  {:<14}{}'.format('case', 'rows', 'rows/s', 'RSS MB', 'vs baseline', 'stages (s)'))
+    for name in names:
+        result = run_isolated(CASES[name])
+        if args.stages:
+            result['stages'] = run_isolated(CASES[name], instrument=True)['stages']
+
+        change, regressed = compare(result, baselines.get(name), args.tolerance)
+        if regressed:
+            regressions.append(name)
+        print('{:<16}{:>10}{:>12.0f}{:>10}  {:<14}{}'.format(
+            name, result['rows'], result['rows_per_sec'],
+            '-' if result['peak_rss_mb'] is None else '{:.0f}'.format(result['peak_rss_mb']),
+            change + (' REGRESSION' if regressed else ''),
+            ' '.join('{}={:.2f}'.format(stage, t) for stage, t in result.get('stages', {}).items())))
+        if args.save:
+            baselines[name] = result
+
+    if args.save:
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print('Saved baselines to {}'.format(args.baselines))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Deterministic synthetic taglists and definition sets for benchmarking BlockGenerator"""
+import os
+import random
+
+DEFAULT_TYPES = {'DMS': 5, 'VAL': 3, 'MOT': 2, 'ANA': 1}  # Block type: relative weight in the taglist
+DESCRIPTIONS = ['Pumpe', 'Ventil', 'Motor', 'Nivå', 'Trykk', 'Temperatur', 'Strømning', 'Kjøling', 'Ærlig']
+
+
+def make_definitions(path, types=None):
+    """Write a .codedef and an .opcdef for every block type"""
+    types = DEFAULT_TYPES if types is None else types
+    code_path = os.path.join(path, 'structures', 'code')
+    opc_path = os.path.join(path, 'structures', 'opc')
+    os.makedirs(code_path, exist_ok=True)
+    os.makedirs(opc_path, exist_ok=True)
+    for typ in types:
+        with open(os.path.join(code_path, typ + '.codedef'), 'w') as f:
+            f.write('P,1,{TAG};\nP,2,{DESCRIPTION};\nP,19,1;\nN,{NODE}.{NAME};\nT,' + typ + ';\n')
+        with open(os.path.join(opc_path, typ + '.opcdef'), 'w') as f:
+            f.write('<Tag name="{TAG}" node="{NODE}" block="{NAME}">{DESCRIPTION}</Tag>\n')
+    return code_path, opc_path
+
+
+def make_taglist(file, rows, nodes=8, types=None, irrelevant_ratio=0.1, seed=0):
+    """
+    Write a taglist with MKZ, TAG, PSRV and BLOCK columns.
+
+    :param rows: Number of tag rows
+    :param nodes: Number of AS nodes the tags are spread over
+    :param types: Block types with relative weights
+    :param irrelevant_ratio: Share of rows with an irrelevant block or node
+    :param seed: Seed, the same arguments always give the same file
+    """
+    types = DEFAULT_TYPES if types is None else types
+    rng = random.Random(seed)
+    names = list(types)
+    weights = [types[name] for name in names]
+    with open(file, 'w') as f:
+        f.write('@Synthetic taglist, {} rows\n'.format(rows))
+        f.write('"MKZ";"TAG";"PSRV";"BLOCK"\n')
+        for index in range(rows):
+            typ = rng.choices(names, weights)[0]
+            block = typ
+            node = rng.randint(1, 4)
+            if rng.random() < irrelevant_ratio:
+                if rng.random() < 0.5:
+                    block = 'SPARE'
+                else:
+                    node = 9
+            bus = 10 + rng.randrange(nodes)
+            desc = '{} {} {}'.format(rng.choice(DESCRIPTIONS), rng.randint(1, 999), 'x' * rng.randint(0, 8))
+            f.write('"{}X{}_{}_B{}";"t{}";"{}";"{}"\n'.format(bus, node, typ, index, index, desc, block))
+
+
+def make_workspace(path, rows, nodes=8, types=None, irrelevant_ratio=0.1, seed=0):
+    """Write a taglist with matching definitions, relevance lists and deviations, returns the file paths"""
+    types = DEFAULT_TYPES if types is None else types
+    os.makedirs(path, exist_ok=True)
+    code_path, opc_path = make_definitions(path, types)
+    files = {'taglist': os.path.join(path, 'taglist.csv'),
+             'code_path': os.path.join(code_path, ''),
+             'opc_path': os.path.join(opc_path, ''),
+             'deviations_file': os.path.join(path, 'structures', 'deviations.csv'),
+             'relevant_blocks_file': os.path.join(path, 'relevant_blocks.txt'),
+             'relevant_nodes_file': os.path.join(path, 'relevant_nodes.txt'),
+             'output_path': os.path.join(path, 'outputs', '')}
+    make_taglist(files['taglist'], rows, nodes, types, irrelevant_ratio, seed)
+    with open(files['deviations_file'], 'w') as f:
+        f.write('@"Block name"; Block type"; "Old definition"; "New definition"\n')
+        f.write('"*"; "{}"; "P,19,1;"; "P,19,2;"\n'.format(next(iter(types))))
+    with open(files['relevant_blocks_file'], 'w') as f:
+        f.write('\n'.join(types) + '\n')
+    with open(files['relevant_nodes_file'], 'w') as f:
+        f.write('1\n2\n3\n4\n')
+    return files
@@ -1,129 +1,1343 @@
 import os
-from tacoshell import TacoShell
-from tkinter import filedialog, IntVar
+import re
+import sys
+import shutil
+import glob
+import fnmatch
+import filecmp
+import hashlib
+import json
+import pickle
+import argparse
+import tempfile
+from io import StringIO
+from time import perf_counter
+from itertools import islice
+from contextlib import nullcontext
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from xml.parsers import expat
+from tacofiles import CsvStream, MappedCsv, interpret_file
 
+if TYPE_CHECKING:  # The command line runs without Tk, the GUI parts import it when a shell adds the mod
+    from tacoshell import TacoShell
 
-class BlockGenerator:
+
+class Reporter:
+    """Silent feedback sink used by BlockGenerator when no shell is attached"""
+
+    def start(self, maximum, source=None):
+        """
+        :param maximum: Progress value at completion
+        :param source: Optional CsvStream, its byte offset is reported as progress instead of rows
+        """
+        pass
+
+    def stopped(self):
+        return False
+
+    def log(self, text, font='normal'):
+        pass
+
+    def progress(self, value, failed=False):
+        pass
+
+    def finish(self):
+        pass
+
+
+class ShellReporter(Reporter):
+    """Forwards generation feedback to a live TacoShell, from its command worker thread"""
+
+    def __init__(self, shell):
+        self.shell: 'TacoShell' = shell
+        self.source = None
+
+    def start(self, maximum, source=None):
+        self.source = source
+        self.shell.update_progress(value=0, maximum=maximum)
+
+    def stopped(self):
+        return self.shell.components['STOP_COMMAND']
+
+    def log(self, text, font='normal'):
+        self.shell.write_to_log(text, font)
+
+    def progress(self, value, failed=False):
+        if self.source is None:
+            self.shell.update_progress(failed=failed, value=value)
+        else:  # Failed rows can not be weighed against bytes in the time estimate
+            self.shell.update_progress(value=self.source.offset)
+
+    def finish(self):
+        self.shell.update_progress(force=True)  # Remainder
+
+
+class ConsoleReporter(Reporter):
+    """Writes generation feedback to a stream, used by the command line interface"""
+
+    def __init__(self, stream=None, verbose=False):
+        self.stream = sys.stderr if stream is None else stream
+        self.verbose = verbose
+
+    def log(self, text, font='normal'):
+        if font in ('muted', 'normal') and not self.verbose:
+            return
+        self.stream.write(text + '\n')
+
+
+class Template:
+    """Definition text compiled once, with its placeholders resolved up front"""
+    placeholders = ('NODE', 'TAG', 'DESCRIPTION', 'NAME')
+    pattern = re.compile(r'{([A-Za-z_][A-Za-z0-9_]*)}')
+
+    def __init__(self, text):
+        self.text = text
+        self.unknown = []
+        fmt = []
+        position = 0
+        text = text.rstrip(' ')
+        for match in self.pattern.finditer(text):
+            fmt.append(self.__escape(text[position:match.start()]))
+            key = match.group(1)
+            if key in self.placeholders:
+                fmt.append('{' + str(self.placeholders.index(key)) + '}')
+            else:
+                self.unknown.append(key)
+                fmt.append(self.__escape(match.group(0)))
+            position = match.end()
+        fmt.append(self.__escape(text[position:]) + '\n')
+        self.__format = ''.join(fmt).format
+
+    @staticmethod
+    def __escape(literal):
+        return literal.replace('{', '{{').replace('}', '}}')
+
+    def render(self, node, tag, desc, name):
+        """Fill in the placeholders of a single tag"""
+        return self.__format(node, tag, desc, name)
+
+    def __reduce__(self):
+        return Template, (self.text,)  # Recompiled on load, so no bound methods end up in a pickle
+
+
+class Definitions(dict):
+    """
+    Compiled definitions per block type, with deviations applied up front.
+
+    Deviations are (block name, block type, old definition, new definition) entries where name and type may be '*'.
+    Repeated entries are applied once and listed in duplicates.
+    Deviations for all block names are patched into the template of each type, while deviations for specific block
+    names get their own pre-patched variants, so picking the template of a tag is a dictionary lookup.
+    """
+
+    def __init__(self, texts, deviations=()):
+        super().__init__()
+        self.variants = {}  # {block name: {block type: Template}}
+        self.unmatched = []  # Deviations that did not change any definition
+        self.malformed = [deviation for deviation in deviations if len(deviation) != 4]
+        self.duplicates = []  # Deviations listed again after their first entry
+
+        unique = OrderedDict()
+        for deviation in deviations:
+            if len(deviation) == 4:
+                deviation = [field.strip() for field in deviation]
+                if tuple(deviation) in unique:
+                    self.duplicates.append(deviation)
+                else:
+                    unique[tuple(deviation)] = deviation
+        deviations = list(unique.values())
+        matched = set()
+        for typ, text in texts.items():
+            self[typ] = Template(self.__patch(text, typ, '*', deviations, matched))
+        for name in sorted({deviation[0] for deviation in deviations if deviation[0] != '*'}):
+            for typ, text in texts.items():
+                if any(deviation[0] == name and deviation[1] in ('*', typ) for deviation in deviations):
+                    self.variants.setdefault(name, {})[typ] = Template(
+                        self.__patch(text, typ, name, deviations, matched))
+        self.unmatched = [deviation for index, deviation in enumerate(deviations) if index not in matched]
+
+    @staticmethod
+    def __patch(text, typ, name, deviations, matched):
+        """Apply deviations for a block name and type in file order"""
+        for index, (dev_name, dev_type, old, new) in enumerate(deviations):
+            if dev_name in ('*', name) and dev_type in ('*', typ) and old in text:
+                text = text.replace(old, new)
+                matched.add(index)
+        return text
+
+    def templates(self):
+        """All compiled templates, including deviating variants"""
+        yield from self.items()
+        for variants in self.variants.values():
+            yield from variants.items()
+
+    def template(self, typ, name):
+        """Template of a block type, patched for a block name"""
+        if self.variants:
+            variants = self.variants.get(name)
+            if variants is not None and typ in variants:
+                return variants[typ]
+        return self[typ]
+
+
+class DefinitionUnpickler(pickle.Unpickler):
+    """Unpickler that only resolves the compiled definition classes, so a cache file can not name other callables"""
+
+    def find_class(self, module, name):
+        for cls in (Definitions, Template):
+            if (module, name) == (cls.__module__, cls.__qualname__):
+                return cls
+        raise pickle.UnpicklingError('{}.{} is not allowed in a definition cache'.format(module, name))
+
+
+class DefinitionStore:
+    """
+    Compiled definitions kept between runs.
+
+    Definition files are revalidated by modification time and size on every lookup. Only files that changed are read
+    again, and definitions are only recompiled when a file or the deviations changed. Deleted files and directories
+    are dropped from the store. With a cache_file the store survives restarts as well.
+
+    The cache file is a pickle behind a header line. Its header and version are checked before anything is unpickled,
+    and unpickling resolves no classes but Definitions and Template. Still, only use cache files written by this tool
+    in a location that nobody else can write to.
+    """
+    version = 3
+    header = b'blockgenerator definition cache '
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file  # None: keep compiled definitions in memory only
+        self.texts = {}  # {file: (mtime, size, text)}
+        self.compiled = {}  # {(directory, extension): (signature, Definitions)}
+        self.reads = 0  # Definition files read from disk
+        self.changed = False  # Not saved to cache_file yet
+        if cache_file is not None:
+            self.__load()
+
+    def definitions(self, path, filt, deviations=()):
+        """Compiled definitions of every file with extension filt in path"""
+        files = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext == '.' + filt and entry.is_file():
+                    stat = entry.stat()
+                    files[name] = (entry.path, stat.st_mtime_ns, stat.st_size)
+
+        key = (os.path.abspath(path), filt)
+        signature = (sorted(files.items()), [tuple(deviation) for deviation in deviations])
+        cached = self.compiled.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        self.__prune()  # Files may have been deleted since the definitions were compiled
+        texts = {}
+        for name, (file, mtime, size) in files.items():
+            known = self.texts.get(file)
+            if known is None or known[:2] != (mtime, size):
+                with open(file, 'r') as f:
+                    known = self.texts[file] = (mtime, size, f.read().rstrip('\n'))
+                self.reads += 1
+            texts[name] = known[2]
+        definitions = Definitions(texts, deviations)
+        self.compiled[key] = (signature, definitions)
+        self.changed = True
+        return definitions
+
+    def save(self):
+        """Write the store to cache_file if anything was recompiled"""
+        if self.cache_file is None or not self.changed:
+            return
+        with open(self.cache_file + '.part', 'wb') as f:
+            f.write(self.header + str(self.version).encode() + b'\n')
+            pickle.dump({'texts': self.texts, 'compiled': self.compiled}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.cache_file + '.part', self.cache_file)
+        self.changed = False
+
+    def __load(self):
+        try:
+            with open(self.cache_file, 'rb') as f:
+                if f.readline(len(self.header) + 16) != self.header + str(self.version).encode() + b'\n':
+                    return  # Not a definition cache, or written by another version
+                cache = DefinitionUnpickler(f).load()
+            self.texts = cache['texts']
+            self.compiled = cache['compiled']
+        except Exception:  # Missing, unreadable or tampered with, rebuilt on save
+            self.texts = {}
+            self.compiled = {}
+        self.__prune()
+
+    def __prune(self):
+        """Drop the texts of deleted files and the definitions of deleted directories"""
+        for file in [file for file in self.texts if not os.path.isfile(file)]:
+            del self.texts[file]
+            self.changed = True
+        for key in [key for key in self.compiled if not os.path.isdir(key[0])]:
+            del self.compiled[key]
+            self.changed = True
+
+
+class TaglistBatch:
+    """
+    Several taglists read as one stream of rows, starting with the header of the first taglist.
+
+    Rows of later taglists are reordered to that header. Rows whose TAG and MKZ already appeared in an earlier taglist
+    are dropped and counted in duplicates.
+    """
+    columns = ('MKZ', 'TAG', 'PSRV', 'BLOCK')
+
+    def __init__(self, files):
+        self.files = files
+        self.size = sum(os.path.getsize(file) for file in files)
+        self.duplicates = 0
+        self.stream = None  # Taglist being read
+        self.done = 0  # Bytes of the taglists read before it
+        self.done_lines = 0
+
+        # Headers are read up front, so a taglist with missing columns fails the run before anything is written
+        with ThreadPoolExecutor(min(8, len(files))) as pool:
+            self.headers = list(pool.map(self.__header, files))
+        for file, header in zip(files, self.headers):
+            missing = [column for column in self.columns if column not in header]
+            if missing:
+                raise ValueError('Taglist {} has no {} column(s)'.format(file, ', '.join(missing)))
+        self.header = self.headers[0]
+        self.rows = self.__rows()
+
+    @staticmethod
+    def __header(file):
+        with CsvStream(file, ';', '"') as stream:
+            return next(stream, [])
+
+    @property
+    def offset(self):
+        return self.done + (0 if self.stream is None else self.stream.offset)
+
+    @property
+    def lines(self):
+        return self.done_lines + (0 if self.stream is None else self.stream.lines)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self.rows.close()
+        if self.stream is not None:
+            self.stream.close()
+
+    def __rows(self):
+        yield self.header
+        idx_of_mkz = self.header.index('MKZ')
+        idx_of_tag = self.header.index('TAG')
+        seen = set()  # TAG and MKZ of the taglists read so far
+        last = len(self.files) - 1
+        for index, (file, header) in enumerate(zip(self.files, self.headers)):
+            self.stream, _ = interpret_file(file, ';', '"')
+            next(self.stream)  # Header
+            order = None if header == self.header else [header.index(column) if column in header else None
+                                                        for column in self.header]
+            added = set()
+            check = index > 0  # Against the taglists read before
+            keep = index != last  # For the taglists read after
+            for data in self.stream:
+                if order is not None:
+                    data = ['' if position is None else data[position] for position in order]
+                if check or keep:
+                    key = data[idx_of_tag].rstrip(' ').upper() + '\x1f' + data[idx_of_mkz].rstrip(' ').upper()
+                    if check and key in seen:
+                        self.duplicates += 1
+                        continue
+                    if keep:
+                        added.add(key)
+                yield data
+            seen |= added
+            self.done += self.stream.size
+            self.done_lines += self.stream.lines
+            self.stream.close()
+            self.stream = None
+
+
+class RelevanceFilter(dict):
+    """
+    Compiled relevance list, indexed by the values it has decided on.
+
+    Entries are matched exactly, '*' matches everything, entries containing glob characters (e.g. '1[0-4]')
+    are matched as globs and entries prefixed with 're:' as regular expressions. Looking up a value
+    (relevance[value]) returns whether it is relevant; each distinct value is only evaluated once.
+    """
+
+    def __init__(self, entries=()):
+        super().__init__()
+        self.exact = set()
+        self.patterns = []
+        self.match_all = False
+        for entry in entries:
+            entry = entry.strip()
+            if entry == '':
+                continue
+            elif entry == '*':
+                self.match_all = True
+            elif entry.startswith('re:'):
+                self.patterns.append(re.compile(entry[3:]).fullmatch)
+            elif any(c in entry for c in '*?['):
+                self.patterns.append(re.compile(fnmatch.translate(entry)).match)
+            else:
+                self.exact.add(entry)
+
+    @classmethod
+    def from_file(cls, file):
+        with open(file, 'r') as f:
+            return cls(f)
+
+    def __missing__(self, value):
+        relevant = self.match_all or value in self.exact or any(match(value) for match in self.patterns)
+        self[value] = relevant
+        return relevant
+
+
+class MkzParser(dict):
+    """
+    Splits MKZ of the form <bus>X<node>_<type>_<name> into (bus, node, AS node, type, name) records.
+
+    Bus nodes repeat for every tag on a bus, so each one is split once and its parts are interned. Malformed MKZ are
+    collected in errors as (row, MKZ) instead of raising.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.types = {}
+        self.errors = []
+
+    def __missing__(self, busnode):
+        parts = busnode.split('X')
+        if len(parts) == 2:
+            bus, node = parts
+            parsed = (sys.intern(bus), sys.intern(node), sys.intern('AS' + bus))
+        else:
+            parsed = None
+        self[busnode] = parsed
+        return parsed
+
+    def parse(self, mkz, row=None):
+        """Record of an MKZ, None if it is malformed"""
+        parts = mkz.split('_')
+        if len(parts) == 3:
+            busnode = self[parts[0]]
+            if busnode is not None:
+                typ = parts[1]
+                return busnode + (self.types.setdefault(typ, typ), parts[2])
+        self.errors.append((row, mkz))
+        return None
+
+
+class TaglistIndex:
+    """
+    Outcome of every taglist row, found from its BLOCK and MKZ columns alone without rendering anything.
+
+    Counts rows per outcome, and rendered rows per AS node and block type. A generation run over the same taglist
+    and relevance lists can take the outcomes over to skip the rows that are ignored anyway.
+    """
+    RENDERED, IRRELEVANT_BLOCK, IRRELEVANT_NODE, MALFORMED = range(4)
+    names = ('rendered', 'irrelevant block', 'irrelevant node', 'malformed MKZ')
+
+    def __init__(self, rows, header, relevant_blocks, relevant_nodes, signature=None):
+        self.signature = signature  # Inputs the outcomes are valid for
+        self.outcomes = bytearray()  # Per row
+        self.counts = []  # Rows per outcome
+        self.nodes = {}  # {AS node: rendered rows}
+        self.types = {}  # {block type: rendered rows}
+        mkz = MkzParser()
+        self.errors = mkz.errors
+
+        idx_of_mkz = header.index('MKZ')
+        idx_of_block = header.index('BLOCK')
+        blocks = {}
+        outcomes = self.outcomes
+        for row, data in enumerate(rows, 1):
+            block = data[idx_of_block]
+            if block not in blocks:
+                blocks[block] = relevant_blocks[block.rstrip(' ').upper()]
+            if not blocks[block]:
+                outcomes.append(self.IRRELEVANT_BLOCK)
+                continue
+            record = mkz.parse(data[idx_of_mkz].rstrip(' ').upper(), row)
+            if record is None:
+                outcomes.append(self.MALFORMED)
+            elif relevant_nodes[record[1]]:
+                outcomes.append(self.RENDERED)
+                self.nodes[record[2]] = self.nodes.get(record[2], 0) + 1
+                self.types[record[3]] = self.types.get(record[3], 0) + 1
+            else:
+                outcomes.append(self.IRRELEVANT_NODE)
+        self.counts = [outcomes.count(outcome) for outcome in range(len(self.names))]
+
+    def missing(self, code_defs):
+        """Block types of rendered rows without a code definition"""
+        return sorted(typ for typ in self.types if typ not in code_defs)
+
+    def summary(self):
+        """Human-readable lines"""
+        lines = ['{} rows: {}'.format(len(self.outcomes), ', '.join('{} {}'.format(count, name) for count, name
+                                                                    in zip(self.counts, self.names)))]
+        for title, counts in (('AS node', self.nodes), ('Block type', self.types)):
+            for key in sorted(counts):
+                lines.append('  {:<24}{:>9} rows'.format(title + ' ' + key, counts[key]))
+        return lines
+
+
+class OutputSink:
+    """Collects output chunks and spills them to disk once they pass spill_size characters"""
+
+    def __init__(self, path=None, spill_size=1 << 20):
+        self.path = path  # None: spill to an anonymous temporary file
+        self.spill_size = spill_size
+        self.chunks = []
+        self.size = 0
+        self.written = 0
+        self.file = None
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.written += len(chunk)
+        if self.spill_size <= self.size:
+            self.flush()
+
+    def flush(self):
+        """Move buffered chunks to disk"""
+        if self.file is None:
+            self.file = tempfile.TemporaryFile('w+') if self.path is None else open(self.path + '.part', 'w')
+        self.file.write(''.join(self.chunks))
+        self.chunks = []
+        self.size = 0
+
+    def drain_into(self, f):
+        """Copy everything written so far into another file"""
+        if self.file is not None:
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, f)
+        f.write(''.join(self.chunks))
+
+    def commit(self, *followers):
+        """
+        Append the followers' contents and move the finished file into place, unless the file there is identical.
+
+        :return: Size of the file in bytes, and whether it was written
+        """
+        self.flush()
+        for sink in followers:
+            sink.drain_into(self.file)
+            sink.discard()
+        self.file.close()
+        self.file = None
+        part = self.path + '.part'
+        size = os.path.getsize(part)
+        if os.path.isfile(self.path) and os.path.getsize(self.path) == size \
+                and filecmp.cmp(part, self.path, shallow=False):
+            os.remove(part)  # Keep the modification time of the unchanged file
+            return size, False
+        os.replace(part, self.path)
+        return size, True
+
+    def discard(self):
+        """Drop all contents, including anything spilled to disk"""
+        self.chunks = []
+        self.size = 0
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            if self.path is not None:
+                os.remove(self.path + '.part')
+
+
+class TailSink(OutputSink):
+    """Output sink for the cycle tail of an .LSE file, fed with (type, name) entries or their lines"""
+    line = 'A,{},{};\nE;\n'
+
+    def append(self, entry):
+        self.write_lines(self.line.format(*entry))
+
+    def write_lines(self, lines):
+        """Add entries formatted with line, the first entry of the tail gets its head and end here"""
+        if self.written == 0 and lines:  # First line of tail
+            lines = 'ZYK,3;\n' + lines.replace('\nE;\n', '\nE,XB,APPL;\n', 1)
+        self.write(lines)
+
+
+class OpcWriter(OutputSink):
+    """
+    Streams the OPC document to disk. The file is opened with the document header, fragments follow in
+    spill_size chunks and commit closes it with the footer. Optionally checks well-formedness on the way.
+    """
+
+    def __init__(self, path, spill_size=1 << 20, header='', footer='', check=False):
+        super().__init__(path, spill_size)
+        self.footer = footer
+        self.root = '' if header else 'OpcProcessTags'  # Fragments without a document are checked under a stand-in root
+        self.parser = None
+        self.error = None  # First well-formedness error, as (line, column, message)
+        if check:
+            self.parser = expat.ParserCreate()
+            if self.root:
+                self.__check('<{}>'.format(self.root))
+        self.file = open(path + '.part', 'w')
+        self.write(header)
+
+    def flush(self):
+        if self.parser is not None:
+            self.__check(''.join(self.chunks))
+        super().flush()
+
+    def commit(self, *followers):
+        self.write(self.footer)
+        result = super().commit(*followers)
+        if self.parser is not None:
+            self.__check('</{}>'.format(self.root) if self.root else '', final=True)
+        return result
+
+    def __check(self, text, final=False):
+        try:
+            self.parser.Parse(text, final)
+        except expat.ExpatError as error:
+            column = error.offset + 1
+            if self.root and error.lineno == 1:
+                column -= len(self.root) + 2  # The stand-in root is not in the file
+            self.error = (error.lineno, column, expat.ErrorString(error.code))
+            self.parser = None  # Expat can not continue after an error
+
+
+class Stats:
+    """Cumulative stage timers and counters of a generation run"""
+    stages = ('load', 'digest', 'parse', 'filter', 'mkz', 'normalize', 'render', 'log', 'progress', 'merge', 'write')
 
     def __init__(self):
+        self.times = OrderedDict((stage, 0.0) for stage in self.stages)
+        self.counters = OrderedDict()
+        self.start = perf_counter()
+
+    def lap(self, stage, last):
+        """Add the time since last to a stage, returns the current time"""
+        now = perf_counter()
+        self.times[stage] += now - last
+        return now
+
+    def count(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def merge(self, times):
+        for stage, value in times.items():
+            self.times[stage] += value
+
+    def report(self):
+        """Machine-readable report"""
+        return {'total': perf_counter() - self.start,
+                'stages': self.times,
+                'counters': self.counters}
+
+    def summary(self):
+        """Human-readable lines, stages sorted by time spent"""
+        total = perf_counter() - self.start
+        lines = ['Run took {:.3f}s: {}'.format(total, ', '.join('{} {}'.format(value, counter)
+                                                                for counter, value in self.counters.items()))]
+        for stage, value in sorted(self.times.items(), key=lambda item: -item[1]):
+            if value:
+                lines.append('  {:<10}{:>9.3f}s{:>7.1%}'.format(stage, value, value / total if total else 0))
+        return lines
+
+
+class FragmentCache:
+    """
+    Rendered chunks of taglist rows from the last incremental run, kept as JSON in the output directory.
+
+    Chunks are keyed by a hash of their rows, so a chunk that did not change is taken over without being parsed or
+    rendered again. All chunks are dropped when the signature, a hash of everything else rendering depends on, changed.
+    The outputs of the last run are recorded with their modification times and sizes, so a run over the same chunks
+    can tell that there is nothing to write.
+    """
+    version = 1
+
+    def __init__(self, file, signature):
+        self.file = file
+        self.signature = signature
+        self.chunks = {}  # {key: [bodies, tails, opc, rows, failed, errors]}, error rows counted from the chunk start
+        self.keys = []  # Chunks of this run, in row order
+        self.sequence = None  # Hash of the chunk keys and the OPC document of the last run
+        self.outputs = {}  # {file: [mtime_ns, size]} as written by the last run
+        self.__load()
+
+    def get(self, key):
+        """Rendered chunk, None if it has to be rendered"""
+        self.keys.append(key)
+        return self.chunks.get(key)
+
+    def put(self, key, chunk):
+        self.chunks[key] = chunk
+
+    def unchanged(self, keys, document):
+        """Whether the outputs of the last run are in place, and were rendered from the same chunks and document"""
+        if not self.outputs or self.sequence != self.__sequence(keys, document):
+            return False
+        for file, stamp in self.outputs.items():
+            try:
+                stat = os.stat(file)
+            except OSError:
+                return False
+            if [stat.st_mtime_ns, stat.st_size] != stamp:
+                return False
+        return True
+
+    def save(self, document, outputs):
+        """Write the chunks of this run, dropping the others, and the outputs they ended up in"""
+        used = set(self.keys)
+        stats = {file: os.stat(file) for file in outputs}
+        data = {'version': self.version,
+                'signature': self.signature,
+                'sequence': self.__sequence(self.keys, document),
+                'outputs': {file: [stat.st_mtime_ns, stat.st_size] for file, stat in stats.items()},
+                'chunks': {key: chunk for key, chunk in self.chunks.items() if key in used}}
+        with open(self.file + '.part', 'w') as f:
+            f.write(json.dumps(data))  # Encoded in one go, json.dump to a file is several times slower
+        os.replace(self.file + '.part', self.file)
+
+    @staticmethod
+    def __sequence(keys, document):
+        return hashlib.sha1('\n'.join(list(keys) + [document]).encode('utf-8')).hexdigest()
+
+    def __load(self):
+        try:
+            with open(self.file, 'r') as f:
+                data = json.load(f)
+            if data['version'] == self.version and data['signature'] == self.signature:
+                self.chunks = data['chunks']
+                self.sequence = data['sequence']
+                self.outputs = data['outputs']
+        except (OSError, ValueError, KeyError):
+            pass  # Everything is rendered, and the cache written anew
+
+
+class BlockRenderer:
+    """Compiled state of a generation run, renders taglist rows into output buffers"""
+    batch_size = 1024  # Rows normalized together before rendering
+
+    def __init__(self, code_defs, opc_defs, relevant_blocks, relevant_nodes, header, override=False):
+        self.code_defs = code_defs
+        self.opc_defs = opc_defs
+        self.relevant_blocks = relevant_blocks
+        self.relevant_nodes = relevant_nodes
+        self.override = override
+        self.timed = False  # Collect stage timings in render_shard
+        self.blocks = {}  # {BLOCK as read: normalized}, a taglist only has a handful of distinct blocks
+        self.mkz = MkzParser()
+        self.outcomes = None  # TaglistIndex outcomes of the rows, None to evaluate every row
+
+        self.idx_of_mkz = header.index('MKZ')
+        self.idx_of_tag = header.index('TAG')
+        self.idx_of_psrv = header.index('PSRV')
+        self.idx_of_block = header.index('BLOCK')
+
+    def normalize(self, rows):
+        """
+        Normalize a batch of rows column by column.
+
+        :return: (block, mkz, tag, description) per row, stripped and upper case. Descriptions have Æ, Ø and Å
+            spelled out and are cut to 15 characters when longer than 16.
+        """
+        blocks = self.blocks
+        column = [data[self.idx_of_block] for data in rows]
+        for block in set(column).difference(blocks):
+            blocks[block] = block.rstrip(' ').upper()
+        column_block = [blocks[block] for block in column]
+        column_mkz = [data[self.idx_of_mkz].rstrip(' ').upper() for data in rows]
+        column_tag = [data[self.idx_of_tag].rstrip(' ').upper() for data in rows]
+        column_desc = [data[self.idx_of_psrv].rstrip(' ').upper() for data in rows]
+        column_desc = [desc if desc.isascii() else desc.replace('Æ', 'AE').replace('Ø', 'OE').replace('Å', 'AA')
+                       for desc in column_desc]
+        column_desc = [desc if len(desc) <= 16 else desc[:15] for desc in column_desc]  # Ensure max 16 chars
+        return zip(column_block, column_mkz, column_tag, column_desc)
+
+    def render(self, rows, start, code_outputs, opc_output, new_output, reporter, stats=None):
+        """
+        Render rows into the outputs.
+
+        :param rows: Taglist rows, the first one having index start
+        :param code_outputs: Buffers per AS node, missing nodes are created through new_output(asnode)
+        :param opc_output: OPC buffer
+        :param reporter: Receives log records and progress
+        :param stats: Optional Stats, receives the time spent per stage
+        :return: Number of ignored rows, or None if the run was stopped
+        """
+        buffered_code_defs = self.code_defs
+        buffered_opc_defs = self.opc_defs
+        relevant_blocks = self.relevant_blocks
+        relevant_nodes = self.relevant_nodes
+        batch_size = self.batch_size
+        parse = self.mkz.parse
+        outcomes = self.outcomes
+        count_failed = 0
+        timed = stats is not None
+        index = start
+        rows = iter(rows)
+        if timed:
+            lap = stats.lap
+            last = perf_counter()
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if timed:
+                last = lap('parse', last)
+            if not batch:
+                break
+            if outcomes is not None:  # Drop rows the index knows are ignored
+                count = len(batch)
+                batch = [data for data, outcome in zip(batch, outcomes[index:index + count]) if not outcome]
+                ignored = count - len(batch)
+                if ignored:
+                    count_failed += ignored
+                    index += ignored
+                    reporter.progress(index, failed=ignored)
+            batch = self.normalize(batch)
+            if timed:
+                last = lap('normalize', last)
+
+            for block, mkz, tag, desc in batch:
+                if reporter.stopped():
+                    return None
+                failed = False
+                if relevant_blocks[block]:
+                    if timed:
+                        last = lap('filter', last)
+                    record = parse(mkz, index + 1)
+                    if timed:
+                        last = lap('mkz', last)
+                    if record is None:
+                        failed = True
+                        reporter.log('{} is not a valid MKZ and was ignored'.format(mkz), 'muted')
+                    elif relevant_nodes[record[1]]:
+                        if timed:
+                            last = lap('filter', last)
+                        _, node, asnode, typ, name = record
+
+                        if asnode not in code_outputs:
+                            code_outputs[asnode] = new_output(asnode)
+                        if typ in buffered_code_defs.keys():
+                            BlockGenerator.write_to_output(buffered_code_defs, code_outputs,
+                                                           typ, tag, asnode, name, desc,
+                                                           post='\n')
+                        else:
+                            if not self.override:
+                                raise Exception('Tag {} is of type {}, but the block definition file was missing'.format(tag, typ))
+
+                        if typ in buffered_opc_defs.keys():
+                            BlockGenerator.write_to_output(buffered_opc_defs, opc_output,
+                                                           typ, tag, asnode, name, desc,
+                                                           key='data')
+                        else:
+                            pass  # allow this case
+                        if timed:
+                            last = lap('render', last)
+
+                        reporter.log('tag: {}, \ttype: {}, \tmkz: {}'.format(tag, typ, mkz))
+                    else:
+                        failed = True
+                        if timed:
+                            last = lap('filter', last)
+                        reporter.log('{} is not listed as a relevant node and was ignored'.format(record[1]), 'muted')
+                else:
+                    failed = True
+                    if timed:
+                        last = lap('filter', last)
+                    reporter.log('{} is not listed as a relevant block and was ignored'.format(block), 'muted')
+                if timed:
+                    last = lap('log', last)
+                count_failed += failed
+                index += 1
+                reporter.progress(index, failed=failed)
+                if timed:
+                    last = lap('progress', last)
+
+        if timed:
+            stats.count('rows', index - start)
+        return count_failed
+
+    def render_shard(self, start, rows):
+        """Render a range of rows into memory, used by pool workers"""
+        code_outputs = {}
+        opc_output = {'data': {'body': StringIO()}}
+        stats = Stats() if self.timed else None
+        count_failed = self.render(rows, start, code_outputs, opc_output,
+                                   lambda _: {'body': StringIO(), 'tail': []}, Reporter(), stats)
+        bodies = {key: buffer['body'].getvalue() for key, buffer in code_outputs.items()}
+        tails = {key: ''.join(TailSink.line.format(*entry) for entry in buffer['tail'])
+                 for key, buffer in code_outputs.items()}
+        errors, self.mkz.errors = self.mkz.errors, []
+        return bodies, tails, opc_output['data']['body'].getvalue(), len(rows), count_failed, errors, \
+            None if stats is None else stats.times
+
+
+_worker_renderer = None
+_worker_taglist = None
+
+
+def _init_worker(renderer, taglist=None):
+    global _worker_renderer, _worker_taglist
+    _worker_renderer = renderer
+    if taglist is not None:  # (file, delimiter, quotechar) of a taglist the worker parses itself
+        _worker_taglist = MappedCsv(*taglist, index=False)
+
+
+def _render_shard(start, rows):
+    return _worker_renderer.render_shard(start, rows)
+
+
+def _render_span(start, begin, end):
+    """Parse a byte range of the taglist and render it, start being the index of its first row"""
+    before = perf_counter()
+    rows = list(_worker_taglist.parse(begin, end))
+    parsed = perf_counter() - before
+    result = _worker_renderer.render_shard(start, rows)
+    if result[-1] is not None:
+        result[-1]['parse'] += parsed
+    return result
+
+
+class BlockGenerator:
+
+    def __init__(self, reporter=None):
         self.source_file = None
         self.parent = None
         self.child_id = None
         self.progressbar = None
+        self.reporter = Reporter() if reporter is None else reporter
+        self.override = False
 
         self.code_path = 'structures/code/'
         self.opc_path = 'structures/opc/'
         self.opc_file = 'OpcProcessTags.XML'
+        self.opc_document = 'document.opcdoc'  # Optional document around the OPC tags, kept with the .opcdef files
+        self.check_opc = False  # Check that the OPC output is well-formed XML while writing it
         self.deviations_file = 'structures/deviations.csv'
+        self.relevant_blocks_file = 'relevant_blocks.txt'
+        self.relevant_nodes_file = 'relevant_nodes.txt'
+        self.output_path = 'outputs/'
+        self.spill_size = 1 << 20  # Characters buffered per output before spilling to disk
+        self.workers = 0  # Worker processes for sharded generation, 0 renders in this process
+        self.shard_size = 20000  # Rows per shard in sharded generation
+        self.chunk_size = 2000  # Rows per cached chunk in incremental generation
+        self.writers = 4  # Threads finishing output files at the end of a run
+        self.incremental = False  # Only render the chunks of rows that changed since the last run
+        self.cache_file = '.fragments.json'  # Rendered chunks of the last run, kept in the output directory
+        self.instrument = False  # Time every stage, summarize in the log and write report_file
+        self.report_file = 'generation_report.json'  # Kept in the output directory
+        self.malformed_file = 'malformed_mkz.csv'  # Taglist rows with a malformed MKZ, kept in the output directory
+        self.stats = None  # Stats of the last instrumented run
+        self.definitions = DefinitionStore()  # Compiled definitions, reused while the files are unchanged
+        self.index = None  # TaglistIndex of the last scan, reused while the taglist and relevance lists are unchanged
 
     def eat_taco(self, parent, child_id):
+        from tacoshell import TacoShell
+        from tkinter import LEFT
+        from tkinter.ttk import Button
         self.child_id = child_id
         self.parent: TacoShell = parent
-        self.parent.components['btn_generate_command'] = self.generate
+        self.parent.components['btn_generate_command'] = TacoShell.threaded(self.generate)
         self.parent.components['btn_open_definition_command'] = self.open_definitions
         self.parent.root_window.title("Block Generator")
         self.progressbar = self.parent.components['bar_progress']
+        self.reporter = ShellReporter(self.parent)
+        self.incremental = True
+        self.check_opc = True
+        scan_taglist = TacoShell.threaded(self.scan_taglist)
+        btn_scan = Button(self.parent.components['frame_generate'], text='Scan',
+                          command=lambda: self.parent.run_command(scan_taglist))
+        btn_scan.pack(side=LEFT, padx=5, pady=5)
+        self.parent.components['btn_scan'] = btn_scan
+
+    def scan_taglist(self):
+        """Scan the taglist in the path field, the next Generate skips the rows found to be ignored"""
+        self.scan(self.parent.variables['command_inputs']['entry_path'])
 
     def generate(self):
-        self.generate_blocks(self.parent.components['entry_path'].get())
+        inputs = self.parent.variables['command_inputs']  # Read on the main thread
+        self.override = inputs['OVERRIDE']
+        self.instrument = inputs['DEBUG_MODE']
+        self.generate_blocks(inputs['entry_path'])
 
     @staticmethod
     def open_definitions():
+        from tkinter import filedialog
         response = filedialog.askopenfilenames(title="Select file",
                                                filetypes=([("Definition file", "*.codedef *.opcdef")]))
         return response
 
     def generate_blocks(self, source_file):
         self.source_file = source_file
+        reporter = self.reporter
+        stats = self.stats = Stats() if self.instrument else None
+        if stats is not None:
+            last = stats.start
 
-        deviations, _ = self.parent.interpret_file(self.deviations_file, ';', '"', buffermode='list')
-        list_tags, count = self.parent.interpret_file(source_file, ';', '"')
-        with open('relevant_blocks.txt', 'r') as f:
-            relevant_blocks = [line.strip() for line in f]
-        with open('relevant_nodes.txt', 'r') as f:
-            relevant_nodes = [line.strip() for line in f]
+        deviations, _ = interpret_file(self.deviations_file, ';', '"', buffermode='list')
+        list_tags, size = self.open_taglists(source_file, mapped=bool(self.workers) or self.incremental)
+        try:
+            relevant_blocks = RelevanceFilter.from_file(self.relevant_blocks_file)
+            relevant_nodes = RelevanceFilter.from_file(self.relevant_nodes_file)
 
-        buffered_code_defs = self.buffer_structures(self.code_path, 'codedef')
-        buffered_opc_defs = self.buffer_structures(self.opc_path, 'opcdef')
+            buffered_code_defs = self.buffer_structures(self.code_path, 'codedef', deviations)
+            buffered_opc_defs = self.buffer_structures(self.opc_path, 'opcdef', deviations)
+            self.definitions.save()
+            for deviation in buffered_code_defs.malformed:
+                self.reporter.log('Deviation "{}" does not have four fields and was ignored'
+                                  .format('"; "'.join(deviation)), 'warning')
+            for deviation in buffered_code_defs.duplicates:
+                self.reporter.log('Deviation "{}" is listed more than once and was applied once'
+                                  .format('"; "'.join(deviation)), 'warning')
+            for deviation in buffered_code_defs.unmatched:
+                if deviation in buffered_opc_defs.unmatched:
+                    self.reporter.log('Deviation "{}" did not match any definition'
+                                      .format('"; "'.join(deviation)), 'warning')
 
-        buffered_code_outputs = {}
-        buffered_opc_output = {'data': {'body': ''}}
+            if not os.path.isdir(self.output_path):
+                os.makedirs(self.output_path)
 
-        header = next(list_tags)
-        idx_of_mkz = header.index('MKZ')
-        idx_of_tag = header.index('TAG')
-        idx_of_psrv = header.index('PSRV')
-        idx_of_block = header.index('BLOCK')
+            header, footer = self.__read_opc_document()
 
-        progress = IntVar()
-        self.progressbar.configure(variable=progress, maximum=count)
+            header_row = next(list_tags)
+            renderer = BlockRenderer(buffered_code_defs, buffered_opc_defs, relevant_blocks, relevant_nodes,
+                                     header_row, self.override)
+            renderer.timed = stats is not None
+            if self.index is not None and self.index.signature == self.__scan_signature(source_file):
+                renderer.outcomes = self.index.outcomes
+                renderer.mkz.errors.extend(self.index.errors)
+                reporter.log('Skipping the {} row(s) the scan found to be ignored'
+                             .format(len(self.index.outcomes) - self.index.counts[TaglistIndex.RENDERED]), 'muted')
+                missing = self.index.missing(buffered_code_defs)
+                if missing and not self.override:
+                    raise Exception('No block definition file for type(s) {}, used by tags in the taglist'
+                                    .format(', '.join(missing)))
+            if stats is not None:
+                last = stats.lap('load', last)
 
-        for index, data in enumerate(list_tags):
-            if self.parent.components['STOP_COMMAND']:
+            cache = keys = None
+            if self.incremental:
+                cache = FragmentCache(os.path.join(self.output_path, self.cache_file),
+                                      self.__chunk_signature(renderer, header_row))
+                if isinstance(list_tags, MappedCsv):  # Hashed up front, nothing needs to be parsed for it
+                    keys = [hashlib.sha1(list_tags.map[slice(*list_tags.span(start, start + self.chunk_size))])
+                            .hexdigest() for start in range(1, len(list_tags), self.chunk_size)]
+                    if stats is not None:
+                        last = stats.lap('digest', last)
+                    if cache.unchanged(keys, header + footer):
+                        reporter.finish()
+                        reporter.log('No changes since last run, outputs in {} are up to date'.format(self.output_path),
+                                     'good')
+                        self.__report(stats)
+                        return
+
+            buffered_code_outputs = {}
+            buffered_opc_output = {'data': {'body': OpcWriter(os.path.join(self.output_path, self.opc_file),
+                                                              self.spill_size, header, footer, self.check_opc)}}
+
+            reporter.start(size, list_tags)
+
+            try:
+                if self.workers or cache is not None:
+                    count_failed = self.__render_chunks(renderer, list_tags, buffered_code_outputs,
+                                                        buffered_opc_output, cache, keys)
+                else:
+                    count_failed = renderer.render(list_tags, 0, buffered_code_outputs, buffered_opc_output,
+                                                   self.__new_code_output, reporter, stats)
+            except BaseException:
+                self.discard_outputs(buffered_code_outputs, buffered_opc_output)
+                raise
+
+            if count_failed is None:  # Stopped
+                self.discard_outputs(buffered_code_outputs, buffered_opc_output)
                 return
-            failed = False
-            block = data[idx_of_block].rstrip(' ').upper()
-            if block in relevant_blocks:
-                busnode, typ, name = data[idx_of_mkz].rstrip(' ').upper().split('_')
-                bus, node = busnode.upper().split('X')
-                if node in relevant_nodes:
-                    asnode = 'AS' + bus
-                    tag = data[idx_of_tag].rstrip(' ').upper()
-                    mkz = data[idx_of_mkz].rstrip(' ').upper()
-                    desc = data[idx_of_psrv].rstrip(' ').upper().replace('Æ', 'AE').replace('Ø', 'OE').replace('Å', 'AA')
-
-                    if 16 < len(desc):  # Ensure max 16 chars
-                        desc = desc[:15]
-
-                    buffered_code_outputs.setdefault(asnode, {'body': '', 'tail': ''})
-                    if typ in buffered_code_defs.keys():
-                        self.write_to_output(buffered_code_defs, buffered_code_outputs,
-                                             typ, tag, asnode, name, desc,
-                                             post='\n')
-                    else:
-                        if not self.parent.override:
-                            raise Exception('Tag {} is of type {}, but the block definition file was missing'.format(tag, typ))
 
-                    if typ in buffered_opc_defs.keys():
-                        self.write_to_output(buffered_opc_defs, buffered_opc_output,
-                                             typ, tag, asnode, name, desc,
-                                             key='data')
-                    else:
-                        pass  # allow this case
+            reporter.finish()
+            if isinstance(list_tags, TaglistBatch):
+                reporter.log('Read {} taglists, skipped {} row(s) whose TAG and MKZ were in an earlier taglist'
+                             .format(len(list_tags.files), list_tags.duplicates))
+            if stats is not None:
+                last = perf_counter()
+                if isinstance(list_tags, TaglistBatch):
+                    stats.count('duplicates', list_tags.duplicates)
+                stats.count('ignored', count_failed)
+                stats.count('malformed', len(renderer.mkz.errors))
+                stats.count('nodes', len(buffered_code_outputs))
+
+            commits = [(buffer['body'], buffer['tail']) for buffer in buffered_code_outputs.values()]
+            opc_writer = buffered_opc_output['data']['body']
+            commits.append((opc_writer,))
+            with ThreadPoolExecutor(self.writers) as pool:
+                results = list(pool.map(lambda sinks: sinks[0].commit(*sinks[1:]), commits))
+            if opc_writer.error is not None:
+                reporter.log('{} is not well-formed XML, line {}, column {}: {}'
+                             .format(self.opc_file, *opc_writer.error), 'warning')
+            self.__report_malformed(renderer.mkz.errors)
+
+            if cache is not None:
+                cache.save(header + footer, [sinks[0].path for sinks in commits])
+            written = [size for size, changed in results if changed]
+            unchanged = [size for size, changed in results if not changed]
+            if stats is not None:
+                stats.lap('write', last)
+                stats.count('bytes written', sum(written))
+                stats.count('bytes unchanged', sum(unchanged))
+
+            if unchanged:
+                reporter.log('Left {} identical file(s) untouched ({} bytes)'.format(len(unchanged), sum(unchanged)))
+            reporter.log('Wrote {} file(s) ({} bytes) to {}'.format(len(written), sum(written), self.output_path),
+                         'good')
+            self.__report(stats)
+        finally:
+            list_tags.close()
+
+    def scan(self, source_file):
+        """Index the taglist from its BLOCK and MKZ columns without generating anything, and log a summary"""
+        relevant_blocks = RelevanceFilter.from_file(self.relevant_blocks_file)
+        relevant_nodes = RelevanceFilter.from_file(self.relevant_nodes_file)
+        code_types = set()
+        with os.scandir(self.code_path) as entries:
+            for entry in entries:
+                name, ext = os.path.splitext(entry.name)
+                if ext == '.codedef':
+                    code_types.add(name)
+
+        list_tags, _ = self.open_taglists(source_file)
+        with list_tags:
+            index = self.index = TaglistIndex(list_tags, next(list_tags), relevant_blocks, relevant_nodes,
+                                              self.__scan_signature(source_file))
+        for line in index.summary():
+            self.reporter.log(line, 'good')
+        missing = index.missing(code_types)
+        if missing:
+            self.reporter.log('No .codedef for block type(s): {}'.format(', '.join(missing)), 'warning')
+        return index
 
-                    self.parent.write_to_log('tag: {}, \ttype: {}, \tmkz: {}'.format(tag, typ, mkz))
+    def __scan_signature(self, source_file):
+        """Modification times and sizes of the inputs that decide the outcome of a row"""
+        files = self.taglists(source_file) + [self.relevant_blocks_file, self.relevant_nodes_file]
+        return [(os.path.abspath(file), os.stat(file).st_mtime_ns, os.stat(file).st_size) for file in files]
+
+    def __report(self, stats):
+        """Summarize an instrumented run in the log and write its report to the output directory"""
+        if stats is None:
+            return
+        for line in stats.summary():
+            self.reporter.log(line, 'debug')
+        with open(os.path.join(self.output_path, self.report_file), 'w') as f:
+            json.dump(stats.report(), f, indent=1)
+
+    def __report_malformed(self, errors):
+        """List rows with a malformed MKZ in the output directory, removing the list of an earlier run"""
+        path = os.path.join(self.output_path, self.malformed_file)
+        if not errors:
+            if os.path.isfile(path):
+                os.remove(path)
+            return
+        with open(path, 'w') as f:
+            f.write('"Row";"MKZ"\n')
+            for row, mkz in errors:
+                f.write('"{}";"{}"\n'.format(row, mkz.replace('"', '""')))
+        self.reporter.log('Ignored {} row(s) with a malformed MKZ, listed in {}'
+                          .format(len(errors), self.malformed_file), 'warning')
+
+    def __render_chunks(self, renderer, rows, buffered_code_outputs, buffered_opc_output, cache=None, keys=None):
+        """
+        Render the rows in chunks, on a process pool if there are workers, and merge them back in row order.
+
+        A memory-mapped taglist is split into byte ranges that the workers parse themselves, other row sources are
+        parsed here and sent to the workers row by row. With a FragmentCache, chunks whose rows did not change are
+        taken from it instead of being rendered.
+
+        :param keys: Cache keys of the chunks of a memory-mapped taglist, hashed from the rows when None
+        """
+        reporter = self.reporter
+        stats = self.stats
+        size = self.shard_size if cache is None else self.chunk_size
+        count_rows = count_failed = 0
+        submitted = shards = reused = 0
+        pending = deque()
+        mapped = isinstance(rows, MappedCsv)
+        errors, renderer.mkz.errors = renderer.mkz.errors, []  # Those of a scan, chunks return their own
+        pool = nullcontext()
+        if self.workers:
+            initargs = (renderer, (rows.file, rows.delimiter, rows.quotechar)) if mapped else (renderer,)
+            pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=initargs)
+        with pool:
+            while True:
+                if stats is not None:
+                    last = perf_counter()
+                key = end = shard = None
+                if mapped:
+                    count = max(0, min(size, len(rows) - 1 - submitted))  # Line 0 is the header
+                    if count:
+                        begin, end = rows.span(submitted + 1, submitted + 1 + count)
+                        if keys is not None:
+                            key = keys[shards]
+                        elif cache is not None:
+                            key = hashlib.sha1(rows.map[begin:end]).hexdigest()
                 else:
-                    failed = True
-                    self.parent.write_to_log('{} is not listed as a relevant node and was ignored'.format(node), 'muted')
-            else:
-                failed = True
-                self.parent.write_to_log('{} is not listed as a relevant block and was ignored'.format(block), 'muted')
-            progress.set(index+1)
-            self.parent.update_progress(failed=failed)
+                    shard = list(islice(rows, size))
+                    count = len(shard)
+                    if count and cache is not None:
+                        key = hashlib.sha1('\n'.join('\x1f'.join(data) for data in shard).encode('utf-8')).hexdigest()
+                if stats is not None:
+                    last = stats.lap('parse', last)
+                    stats.count('rows', count)
+
+                if count:
+                    chunk = None if cache is None else cache.get(key)
+                    if chunk is not None:
+                        future = Future()
+                        bodies, tails, opc, chunk_rows, failed, chunk_errors = chunk
+                        future.set_result((bodies, tails, opc, chunk_rows, failed,
+                                           [(row + submitted, mkz) for row, mkz in chunk_errors], None))
+                        reused += 1
+                    elif self.workers and mapped:
+                        future = pool.submit(_render_span, submitted, begin, end)
+                    elif self.workers:
+                        future = pool.submit(_render_shard, submitted, shard)
+                    else:
+                        if mapped:
+                            shard = list(rows.parse(begin, end))
+                            if stats is not None:
+                                last = stats.lap('parse', last)
+                        future = Future()
+                        future.set_result(renderer.render_shard(submitted, shard))
+                    pending.append((future, submitted, end, key, chunk is None))
+                    submitted += count
+                    shards += 1
+                    if len(pending) < 2 * self.workers:  # Bound the rendered shards held in memory
+                        continue
+                if not pending:
+                    break
+
+                future, start, end, key, rendered = pending.popleft()
+                bodies, tails, opc, count, failed, chunk_errors, times = future.result()
+                if end is not None:
+                    rows.offset = end
+                if stats is not None:
+                    last = perf_counter()
+                    if times is not None:
+                        stats.merge(times)
+                if cache is not None and rendered:
+                    cache.put(key, [bodies, tails, opc, count, failed,
+                                    [(row - start, mkz) for row, mkz in chunk_errors]])
+                for asnode, body in bodies.items():
+                    if asnode not in buffered_code_outputs:
+                        buffered_code_outputs[asnode] = self.__new_code_output(asnode)
+                    buffered_code_outputs[asnode]['body'].write(body)
+                    buffered_code_outputs[asnode]['tail'].write_lines(tails[asnode])
+                buffered_opc_output['data']['body'].write(opc)
+                errors.extend(chunk_errors)
+
+                count_rows += count
+                count_failed += failed
+                reporter.progress(count_rows, failed=failed)
+                if stats is not None:
+                    stats.lap('merge', last)
+                if reporter.stopped():
+                    for future, *_ in pending:
+                        future.cancel()
+                    return None
+
+        renderer.mkz.errors = errors
+        if self.workers:
+            reporter.log('Rendered {} rows in {} shards on {} workers'.format(count_rows, shards, self.workers))
+        if cache is not None:
+            reporter.log('Took {} of {} chunks over from the last run'.format(reused, shards))
+            if stats is not None:
+                stats.count('chunks reused', reused)
+        return count_failed
 
-        self.parent.update_progress(force=True)  # Remainder
+    def __chunk_signature(self, renderer, header):
+        """Hash of everything the rendering of a chunk depends on, other than its rows"""
+        inputs = [header, renderer.override, renderer.outcomes is not None]
+        for definitions in (renderer.code_defs, renderer.opc_defs):
+            inputs.append(sorted((typ, template.text) for typ, template in definitions.items()))
+            inputs.append(sorted((name, typ, template.text) for name, variants in definitions.variants.items()
+                                 for typ, template in variants.items()))
+        for file in (self.relevant_blocks_file, self.relevant_nodes_file):
+            with open(file, 'r') as f:
+                inputs.append(f.read())
+        return hashlib.sha1(json.dumps(inputs).encode('utf-8')).hexdigest()
 
-        if not os.path.isdir('outputs'):
-            os.makedirs('outputs')
+    def __read_opc_document(self):
+        """Header and footer around the OPC tags, from the {TAGS} placeholder of the document file"""
+        file = os.path.join(self.opc_path, self.opc_document)
+        if not os.path.isfile(file):
+            return '', ''
+        with open(file, 'r') as f:
+            text = f.read()
+        if '{TAGS}' not in text:
+            self.reporter.log('{} has no {{TAGS}} placeholder and was ignored'.format(self.opc_document), 'warning')
+            return '', ''
+        header, footer = text.split('{TAGS}', 1)
+        return header, footer
 
-        for key, buffer in buffered_code_outputs.items():
-            with open('outputs/' + key + '.LSE', 'w+') as f:
-                f.write(buffer['body'])
-                f.write(buffer['tail'])
+    @staticmethod
+    def taglists(source):
+        """Taglist files named by a file, a directory of .csv files or a glob pattern"""
+        if os.path.isfile(source):
+            return [source]
+        if os.path.isdir(source):
+            files = sorted(glob.glob(os.path.join(source, '*.csv')))
+        else:
+            files = sorted(file for file in glob.glob(source) if os.path.isfile(file))
+        if not files:
+            raise FileNotFoundError('No taglists found at {}'.format(source))
+        return files
+
+    def open_taglists(self, source, mapped=False):
+        """
+        Rows of the taglist(s) named by source, header first, and their size in bytes.
+
+        :param mapped: Memory-map a single taglist with an index of its lines, so shards can be parsed by workers
+        """
+        files = self.taglists(source)
+        if files == [source]:
+            if mapped:
+                taglist = MappedCsv(source, ';', '"')
+                return taglist, taglist.size
+            return interpret_file(source, ';', '"')
+        batch = TaglistBatch(files)
+        return batch, batch.size
 
-        with open('outputs/' + self.opc_file, 'w+') as f:
-            f.write(buffered_opc_output['data']['body'])
+    def __new_code_output(self, asnode):
+        return {'body': self.__sink(asnode + '.LSE'), 'tail': TailSink(spill_size=self.spill_size)}
 
-        self.parent.write_to_log('Wrote results to outputs\\', 'good')
+    def __sink(self, file):
+        """Create an output sink for a file in the output directory"""
+        return OutputSink(os.path.join(self.output_path, file), self.spill_size)
 
     @staticmethod
-    def buffer_structures(path, filt):
-        buffer = {}
-        for file in os.listdir(path):
-            name, ext = os.path.basename(file).split('.')
-            if ext == filt:
-                with open(path + file, 'r') as f:
-                    buffer[name] = f.read().rstrip('\n')
+    def discard_outputs(*buffered_outputs):
+        """Drop unfinished outputs, leaving any previous results untouched"""
+        for outputs in buffered_outputs:
+            for buffer in outputs.values():
+                for sink in buffer.values():
+                    sink.discard()
+
+    def buffer_structures(self, path, filt, deviations=()):
+        """Compiled definitions of every file of a kind, with deviations applied"""
+        buffer = self.definitions.definitions(path, filt, deviations)
+        for typ, template in buffer.templates():
+            if template.unknown:
+                self.reporter.log('{}.{} contains unknown placeholder(s): {}'
+                                  .format(typ, filt, ', '.join(template.unknown)), 'warning')
         return buffer
 
     @staticmethod
@@ -135,28 +1349,94 @@ class BlockGenerator:
             if desc is None:
                 desc = tag
 
-            code = buffered_defs[typ] \
-                .rstrip(' ') \
-                .replace('{NODE}', node) \
-                .replace('{TAG}', tag) \
-                .replace('{DESCRIPTION}', desc) \
-                .replace('{NAME}', name) \
-                + '\n'
+            code = buffered_defs.template(typ, name).render(node, tag, desc, name)
 
             if key is None:
                 key = node
 
-            buffered_outputs[key]['body'] += code + post
+            buffered_outputs[key]['body'].write(code + post)
             if 'tail' in buffered_outputs[key].keys():
-                if buffered_outputs[key]['tail'] == '':  # First line of tail
-                    sub_head = 'ZYK,3;\n'
-                    sub_tail = ',XB,APPL'
-                else:
-                    sub_head = ''
-                    sub_tail = ''
-                buffered_outputs[key]['tail'] += '{}A,{},{};\nE{};\n'\
-                    .format(sub_head, typ, name, sub_tail)
+                buffered_outputs[key]['tail'].append((typ, name))
 
 
 def make_taco():
-    return BlockGenerator()
\ No newline at end of file
+    return BlockGenerator()
+
+
+def at_least(minimum):
+    """Argument type of whole numbers of at least minimum"""
+    def parse(text):
+        value = int(text)
+        if value < minimum:
+            raise argparse.ArgumentTypeError('must be at least {}, got {}'.format(minimum, value))
+        return value
+    parse.__name__ = 'int'  # Named in argparse's message for values that are no number
+    return parse
+
+
+def main(argv=None):
+    """Generate block outputs from the command line, without a GUI"""
+    parser = argparse.ArgumentParser(prog='python -m mods.blockgenerator',
+                                     description='Generate LSE/OPC outputs from a taglist without a GUI')
+    parser.add_argument('taglist', help='Taglist (.csv) to generate from, or a directory or glob pattern of taglists '
+                                        'to merge')
+    parser.add_argument('--out', default='outputs/', help='Output directory (default: outputs/)')
+    parser.add_argument('--code', default='structures/code/', help='Directory of .codedef files')
+    parser.add_argument('--opc', default='structures/opc/', help='Directory of .opcdef files')
+    parser.add_argument('--deviations', default='structures/deviations.csv', help='Deviations file')
+    parser.add_argument('--relevant-blocks', default='relevant_blocks.txt', help='List of relevant blocks (exact, *, glob or re: entries)')
+    parser.add_argument('--relevant-nodes', default='relevant_nodes.txt', help='List of relevant nodes (exact, *, glob or re: entries)')
+    parser.add_argument('--definition-cache', metavar='FILE',
+                        help='Keep compiled definitions in this file, so later runs only reload changed ones. '
+                             'Only use a cache file written by this tool, in a location nobody else can write to')
+    parser.add_argument('--override', action='store_true',
+                        help='Skip tags whose block definition file is missing instead of failing')
+    parser.add_argument('--spill-size', type=int, default=1 << 20,
+                        help='Characters buffered per output file before spilling to disk')
+    parser.add_argument('-j', '--workers', type=at_least(0), default=0,
+                        help='Render on this many worker processes (default: 0, render in this process)')
+    parser.add_argument('--shard-size', type=at_least(1), default=20000, help='Rows per worker shard')
+    parser.add_argument('--writers', type=at_least(1), default=4,
+                        help='Threads finishing the output files (default: 4)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Only render the chunks of taglist rows that changed since the last run, the rendered '
+                             'chunks are kept in .fragments.json in the output directory')
+    parser.add_argument('--check-opc', action='store_true',
+                        help='Check that OpcProcessTags.XML is well-formed XML while writing it')
+    parser.add_argument('--scan', action='store_true',
+                        help='Only count the rows per AS node, block type and outcome, and list missing .codedef files')
+    parser.add_argument('--generate', action='store_true',
+                        help='With --scan, generate afterwards, skipping the rows the scan found to be ignored')
+    parser.add_argument('--stats', action='store_true',
+                        help='Time every stage, print a summary and write generation_report.json to the output')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log every processed and ignored tag')
+    args = parser.parse_args(argv)
+
+    generator = BlockGenerator(reporter=ConsoleReporter(verbose=args.verbose))
+    generator.output_path = args.out
+    generator.code_path = os.path.join(args.code, '')
+    generator.opc_path = os.path.join(args.opc, '')
+    generator.deviations_file = args.deviations
+    generator.definitions = DefinitionStore(args.definition_cache)
+    generator.relevant_blocks_file = args.relevant_blocks
+    generator.relevant_nodes_file = args.relevant_nodes
+    generator.override = args.override
+    generator.spill_size = args.spill_size
+    generator.workers = args.workers
+    generator.shard_size = args.shard_size
+    generator.writers = args.writers
+    generator.incremental = args.incremental
+    generator.check_opc = args.check_opc
+    generator.instrument = args.stats
+    if args.scan:
+        generator.scan(args.taglist)
+        if not args.generate:
+            return 0
+    generator.generate_blocks(args.taglist)
+    return 0
+
+
+if __name__ == '__main__':
+    # Run the module under its package name, so pickled classes are found by the GUI and worker processes too
+    from mods import blockgenerator
+    sys.exit(blockgenerator.main())
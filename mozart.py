@@ -1,4 +1,8 @@
+import os
+import sys
 import traceback
+import zipimport
+from time import time, perf_counter
 from functools import wraps
 import logging
 from importlib import import_module, reload
@@ -52,6 +56,8 @@ class Mozart:
     mod = None
 
     def __init__(self, *args, **kwargs):
+        self.mtimes = {}  # Modification time of every watched module when it was last loaded
+        self.checked = time()  # Modules first seen later count as loaded at this time
         self.symphony = self.influence = self.load(*args, **kwargs)
 
     def load(self, *args, **kwargs):
@@ -63,14 +69,163 @@ class Mozart:
         self.symphony.start()
 
     def mreload(self):
-        self.mod = reload(self.mod)
-        self.influence = self.mod.TacoShell(**{'init': False})
-        print('symphony was influenced')
+        """
+        Reload the changed modules (tacoshell and mods) and the modules that depend on them, keeping the live window.
+
+        The functions of a reloaded module get the new code in place, so callbacks the window already holds run the
+        new code too, and the live TacoShell and mod instances are moved onto the new classes with their state.
+        """
+        start = perf_counter()
+        modules = self.__watched()
+        changed = [name for name, module in modules.items()
+                   if self.__mtime(module) > self.mtimes.get(name, self.checked)]
+        order = self.__dependents(modules, changed)
+
+        reloaded = []
+        classes = {}
+        for name in order:
+            module = modules[name]
+            try:
+                classes.update(self.__reload(module))
+            except:
+                traceback.print_exc()
+                self.__report('Reloading {} failed, kept the previous code'.format(name), 'bad')
+                break
+            self.mtimes[name] = self.__mtime(module)
+            reloaded.append(name)
+        self.checked = time()
+
+        self.mod = sys.modules['tacoshell']
+        self.__migrate(classes)
+        self.influence = self.symphony
+        if reloaded:
+            self.__report('Reloaded {} in {:.1f} ms'.format(', '.join(reloaded), (perf_counter() - start) * 1000))
+        elif not order:
+            self.__report('Nothing changed since the last reload')
+
+    @staticmethod
+    def __watched():
+        """Modules that can be reloaded: tacoshell and the loaded mods"""
+        return {name: module for name, module in list(sys.modules.items())
+                if module is not None and (name == 'tacoshell' or name.startswith('mods.'))
+                and getattr(module, '__file__', None)}
+
+    @staticmethod
+    def __mtime(module):
+        file = getattr(module.__loader__, 'archive', None) or module.__file__  # Mods loaded from a zip bundle
+        try:
+            return os.stat(file).st_mtime
+        except OSError:
+            return 0
+
+    @staticmethod
+    def __dependents(modules, changed):
+        """The changed modules and every module using them, dependencies first"""
+        names = {id(module): name for name, module in modules.items()}
+        depends = {}
+        for name, module in modules.items():
+            depends[name] = set()
+            for value in list(vars(module).values()):
+                used = names[id(value)] if id(value) in names else getattr(value, '__module__', None)
+                if used in modules and used != name:
+                    depends[name].add(used)
+
+        selected = set(changed)
+        grown = True
+        while grown:
+            grown = False
+            for name, uses in depends.items():
+                if name not in selected and uses & selected:
+                    selected.add(name)
+                    grown = True
+
+        order = []
+        while selected:
+            ready = sorted(name for name in selected if not depends[name] & selected)
+            if not ready:  # Circular imports, reload the rest as is
+                ready = sorted(selected)
+            order.extend(ready)
+            selected.difference_update(ready)
+        return order
+
+    @classmethod
+    def __reload(cls, module):
+        """Reload a module in place, returns the new class of every class it had"""
+        previous = dict(vars(module))
+        importer = getattr(module.__loader__, 'archive', None)
+        if importer is None:
+            reload(module)
+        else:  # zip bundles are not on a path reload can search
+            importer = zipimport.zipimporter(importer)
+            if hasattr(importer, 'invalidate_caches'):
+                importer.invalidate_caches()
+            spec = importer.find_spec(module.__name__)
+            module.__spec__, module.__loader__ = spec, spec.loader
+            spec.loader.exec_module(module)
+
+        classes = {}
+        for key, old in previous.items():
+            new = vars(module).get(key)
+            if new is old:
+                continue
+            if isinstance(old, type) and isinstance(new, type) and old.__module__ == module.__name__:
+                cls.__update_class(old, new, classes)
+            elif callable(old) and hasattr(old, '__code__') and hasattr(new, '__code__'):
+                cls.__update_function(old, new)
+        return classes
+
+    @classmethod
+    def __update_class(cls, old, new, classes):
+        """Give the functions of an old class the code of the new one, nested classes included"""
+        classes[old] = new
+        for key, value in vars(old).items():
+            replacement = vars(new).get(key)
+            if isinstance(value, type) and isinstance(replacement, type):
+                cls.__update_class(value, replacement, classes)
+                continue
+            if isinstance(value, (staticmethod, classmethod)) and isinstance(replacement, type(value)):
+                value, replacement = value.__func__, replacement.__func__
+            if hasattr(value, '__code__') and hasattr(replacement, '__code__'):
+                cls.__update_function(value, replacement)
+
+    @staticmethod
+    def __update_function(old, new):
+        try:
+            old.__code__ = new.__code__
+            old.__defaults__ = new.__defaults__
+            old.__kwdefaults__ = new.__kwdefaults__
+        except ValueError:  # Different closure, only new references get the new code
+            pass
+
+    def __migrate(self, classes):
+        """Move the live TacoShell, its mods and its widgets onto the reloaded classes"""
+        if not classes:
+            return
+        variables = self.symphony.variables
+        components = self.symphony.components
+        live = [self.symphony]
+        live.extend(variables.get('children', {}).values())
+        for value in list(components.values()):
+            live.extend(value if isinstance(value, (list, tuple)) else [value])
+        for obj in live:
+            new = classes.get(type(obj))
+            if new is not None:
+                try:
+                    obj.__class__ = new
+                except TypeError:  # Incompatible layout, keeps the old class
+                    pass
+
+    def __report(self, message, font='normal'):
+        print(message)
+        try:
+            self.symphony.write_to_log(message, font)
+        except:
+            traceback.print_exc()
 
 
 def main():
     try:
-        composer = Mozart()
+        composer = Mozart(**import_module('tacoshell').startup_options())
         composer.start()
 
     except:
@@ -0,0 +1,246 @@
+"""File helpers of TacoShell that need no GUI, so headless tools can use them without Tk"""
+import re
+import csv
+import os
+import locale
+import mmap
+from array import array
+from bisect import bisect_right
+
+
+class CsvStream:
+    """Lazily interprets a delimited file line by line, skipping empty and '@' comment lines"""
+
+    def __init__(self, file, delimiter=None, quotechar=None):
+        self.file = file
+        self.size = os.path.getsize(file)
+        self.offset = 0  # Bytes consumed so far
+        self.lines = 0
+        self.encoding = locale.getpreferredencoding(False)
+
+        kwargs = {'delimiter': delimiter,
+                  'skipinitialspace': True}
+        if quotechar is None:
+            kwargs['quoting'] = csv.QUOTE_NONE
+        else:
+            kwargs['quotechar'] = quotechar
+        self.filtered = self.__filtered_lines()
+        self.reader = csv.reader(self.filtered, **kwargs)
+
+    def __filtered_lines(self):
+        encoding = self.encoding
+        with open(self.file, 'rb') as f:
+            for raw_line in f:
+                self.offset += len(raw_line)
+                self.lines += 1
+                strip_line = raw_line.decode(encoding).strip(' \t\r\n')
+                if strip_line and strip_line[0] != '@':
+                    yield strip_line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.reader)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Close the file, also when it was not read to the end"""
+        self.filtered.close()
+
+
+class MappedFile:
+    """
+    Read-only memory map of a file, with the byte offsets of its lines.
+
+    Empty files can not be mapped and read as b''.
+    """
+
+    newline = re.compile(rb'\n(?=[\s\S])')  # Ends a line that another line follows
+
+    def __init__(self, file, encoding=None):
+        self.file = file
+        self.size = os.path.getsize(file)
+        self.encoding = locale.getpreferredencoding(False) if encoding is None else encoding
+        if self.size:
+            with open(file, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = b''
+
+    def line_starts(self, begin=0, end=None, pattern=None):
+        """
+        Starts of the lines after begin, up to and including end, that follow a newline matching pattern (any newline
+        by default). They are found by the regular expression engine rather than a loop in Python.
+        """
+        end = self.size if end is None else end
+        return map(re.Match.end, (pattern or self.newline).finditer(self.map, begin, min(end + 1, self.size)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Unmap the file, so it is not held open (and locked, on Windows) until garbage collection"""
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = b''
+
+
+class MappedCsv(MappedFile):
+    """
+    Memory-mapped delimited file with the byte offset of every data line (not empty, not an '@' comment).
+
+    The offsets are found in one scan, after which rows can be read from any data line on, and byte ranges of
+    data lines can be parsed independently, e.g. by other processes that map the same file.
+    """
+
+    data_line = re.compile(rb'\n(?=[ \t\r]*[^@ \t\r\n])')  # Ends a line followed by a data line
+
+    def __init__(self, file, delimiter=None, quotechar=None, index=True):
+        super().__init__(file)
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.offset = 0  # Bytes consumed so far
+        self.lines = array('Q')  # Start of every data line
+
+        self.kwargs = {'delimiter': delimiter,
+                       'skipinitialspace': True}
+        if quotechar is None:
+            self.kwargs['quoting'] = csv.QUOTE_NONE
+        else:
+            self.kwargs['quotechar'] = quotechar
+
+        if index:
+            self.__index()
+        self.rows = self.read()
+
+    def __index(self):
+        end = self.map.find(b'\n')
+        first = self.map[:self.size if end < 0 else end].strip(b' \t\r\n')
+        if first and first[:1] != b'@':
+            self.lines.append(0)
+        self.lines.extend(self.line_starts(pattern=self.data_line))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def span(self, start, stop=None):
+        """Byte range of the data lines from start up to stop"""
+        return self.lines[start], self.size if stop is None or len(self.lines) <= stop else self.lines[stop]
+
+    def parse(self, begin, end):
+        """Rows of the data lines in a byte range"""
+        text = str(memoryview(self.map)[begin:end], self.encoding)
+        lines = (line.strip(' \t\r\n') for line in text.split('\n'))
+        return csv.reader((line for line in lines if line and line[0] != '@'), **self.kwargs)
+
+    def read(self, start=0, stop=None, chunk=1000):
+        """Rows from data line start up to stop, parsed chunk lines at a time"""
+        stop = len(self.lines) if stop is None else min(stop, len(self.lines))
+        for position in range(start, stop, chunk):
+            begin, end = self.span(position, min(position + chunk, stop))
+            yield from self.parse(begin, end)
+            self.offset = end
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.rows)
+
+    def close(self):
+        self.rows.close()
+        super().close()
+
+
+class LineIndex(MappedFile):
+    """
+    Memory-mapped text file with the byte offset of every line start, indexed a chunk at a time.
+
+    Moving a number of lines from a position needs no index, so any part of the file can be read right away while
+    the index is still being built, e.g. when the GUI is idle.
+    """
+
+    def __init__(self, file, encoding=None):
+        super().__init__(file, encoding)
+        self.lines = array('Q', [0])  # Start of every line indexed so far
+        self.indexed = 0  # Bytes indexed so far
+
+    @property
+    def complete(self):
+        return self.indexed >= self.size
+
+    def extend(self, chunk=8 << 20):
+        """Index the next chunk bytes, returns whether the whole file is indexed"""
+        end = min(self.indexed + chunk, self.size)
+        self.lines.extend(self.line_starts(self.indexed, end))
+        self.indexed = end
+        return self.complete
+
+    def line(self, position):
+        """Number (from 0) of the line holding a byte, None if not indexed yet"""
+        if position >= self.indexed and not self.complete:
+            return None
+        return bisect_right(self.lines, position) - 1
+
+    def start(self, position):
+        """Start of the line holding a byte"""
+        return self.map.rfind(b'\n', 0, position) + 1 if position else 0
+
+    def forward(self, position, count):
+        """Byte after count lines from a line start, the file size at most"""
+        for _ in range(count):
+            if position >= self.size:
+                break
+            end = self.map.find(b'\n', position)
+            position = self.size if end < 0 else end + 1
+        return position
+
+    def backward(self, position, count):
+        """Start of the line count lines before a line start, 0 at least"""
+        for _ in range(count):
+            if position <= 0:
+                break
+            position = self.map.rfind(b'\n', 0, position - 1) + 1
+        return position
+
+    def starts(self, begin, end):
+        """Line starts in a byte range that begins at a line start"""
+        starts = [begin]
+        starts.extend(self.line_starts(begin, end - 1))
+        return starts
+
+    def text(self, begin, end):
+        return str(memoryview(self.map)[begin:end], self.encoding, 'replace')
+
+
+def interpret_file(file, delimiter=None, quotechar=None, buffermode=''):
+    """
+    Interpret .csv
+
+    :return: The interpretation and, for the default lazy iterator, the file size in bytes which the
+             iterator's offset attribute progresses towards. For 'list' and 'dict' the number of lines read.
+    """
+    stream = CsvStream(file, delimiter, quotechar)
+
+    if buffermode == 'list':
+        # Returns a buffer in the form of a list instead of iterator
+        out_buffer = [line for line in stream]
+        interpretation = out_buffer
+    elif buffermode == 'dict':
+        # Returns a buffer in the form of a dict with the first index element as key and the second as value
+        # Requires return from iterator to be exactly two values
+        out_buffer = {key: value for key, value in stream}
+        interpretation = out_buffer
+    else:
+        return stream, stream.size
+
+    return interpretation, stream.lines
@@ -2,20 +2,28 @@ from tkinter import Tk, filedialog, messagebox, Text, Menu, Canvas, LEFT, RIGHT,
     Toplevel, StringVar, BooleanVar, HORIZONTAL, VERTICAL, GROOVE, CENTER, END, INSERT
 from tkinter import Label as TkLabel, Button as TkButton
 from tkinter.ttk import Button, Progressbar, Notebook, Style, Entry, OptionMenu, Frame, Scrollbar, Label
-from PIL.ImageTk import PhotoImage
-from PIL.Image import ANTIALIAS
-from PIL import Image
-import csv
 import os
+import sys
+import ast
+import json
+import hashlib
+import zipfile
+import zipimport
+import argparse
+import glob
 import logging
 from datetime import datetime
 import traceback
+import threading
+from queue import Queue, Empty
+from bisect import bisect_right
 from importlib import import_module
+from importlib.util import module_from_spec
 import xml.etree.cElementTree as ElementTree
-from xml.dom.minidom import parseString
 from collections import OrderedDict
-from time import time
+from time import time, perf_counter
 from functools import wraps
+import tacofiles
 
 
 class TacoShell:
@@ -30,14 +38,15 @@ class TacoShell:
     __version__ = '1.0'
     directory = os.path.dirname(__file__) + '/'
 
-    def __init__(self, user_variables=None, user_settings=None, conductor=None, init=True):
-        # TODO: After a new mod is added, restart is required for it to show up in flags - FIX
-        #       Place mods in a separate folder
-
+    def __init__(self, user_variables=None, user_settings=None, conductor=None, init=True,
+                 lazy_mods=False, profile_startup=False):
         if not init:
             return
 
         """Initialize"""
+        started = perf_counter()
+        profile = OrderedDict() if profile_startup else None  # Seconds per startup phase
+
         # ROOT settings
         self.root_window = Tk()
         Tk.report_callback_exception = self.__on_error
@@ -55,24 +64,38 @@ class TacoShell:
         self.variables = {}  # Intrinsic program variables
         self.settings = {}  # Intrinsic program settings
 
+        self.variables['startup_profile'] = profile
+        self.variables['startup_mods'] = OrderedDict()  # Import and total seconds per mod, part of a phase
+        self.variables['startup_time'] = started
+        self.variables['lazy_mods'] = lazy_mods  # Import enabled mods once the window is shown, or when first used
+        if profile is not None:
+            profile['window'] = perf_counter() - started
+
         # Initializations
-        self.__init_variables()
-        self.__init_appearance()
-        self.__init_theme()
-        self.__init_menu()
-        self.__init_debug()
-        self.__init_frame_source()
-        self.__init_frame_generate()
-        self.__init_frame_progress()
-        self.__init_frame_tabs()
-        self.__set_packing()
-        self.__collect_mods()
-        self.__link_user_variables(user_variables)
-        self.__interpret_user_settings(user_settings)
-        self.__interpret_xml_config()
-        self.__position_window(self.root_window, *self.components['window_dimensions'])
-        self.__repack()
-        self.__display_initialization_summary()
+        for phase, initialize in (
+                ('variables', self.__init_variables),
+                ('appearance', self.__init_appearance),
+                ('theme', self.__init_theme),
+                ('menu', self.__init_menu),
+                ('debug frame', self.__init_debug),
+                ('source frame', self.__init_frame_source),
+                ('generate frame', self.__init_frame_generate),
+                ('progress frame', self.__init_frame_progress),
+                ('tabs frame', self.__init_frame_tabs),
+                ('packing', self.__set_packing),
+                ('mod list', self.__collect_mods),
+                ('user variables', lambda: self.__link_user_variables(user_variables)),
+                ('user settings', lambda: self.__interpret_user_settings(user_settings)),
+                ('config', self.__interpret_xml_config),
+                ('layout', lambda: self.__position_window(self.root_window, *self.components['window_dimensions'])),
+                ('repack', self.__repack),
+                ('summary', self.__display_initialization_summary)):
+            start = perf_counter()
+            initialize()
+            if profile is not None:
+                profile[phase] = profile.get(phase, 0) + perf_counter() - start
+        self.variables['is_initialized'] = True
+        self.root_window.after_idle(self.__after_startup)
 
     def __init_variables(self):
         self.variables['EXPERIMENTAL_MODE'] = True  # Flag for testing extensive, experimental program changes
@@ -80,19 +103,36 @@ class TacoShell:
         self.variables['OVERRIDE'] = False
         self.variables['is_running'] = False
         self.variables['progress_update_cycle'] = 1 / 10
+        self.variables['log_flush_cycle'] = 100  # Milliseconds between bulk inserts into txt_log
+        self.variables['log_queue'] = []  # Pending text and font pairs, flattened for Text.insert
+        self.variables['log_flush_id'] = None
+        self.variables['muted_counters'] = OrderedDict()  # Muted messages collapsed while processing
+        self.variables['is_processing'] = False
+        self.variables['worker_queue'] = Queue()  # Log records and completion posted by the command worker thread
+        self.variables['command_inputs'] = {}  # Tk inputs read on the main thread when the command started
+        self.variables['worker_poll_id'] = None
+        self.variables['worker_poll_limit'] = 500  # Worker queue items handled per poll
         self.variables['help_text'] = 'This won\'t help you at all..'
         self.variables['about_text'] = 'TacoShell v' + self.__version__ + '\nby Eivind Brate Midtun'
         self.variables['next_child_id'] = 0
         self.variables['config_file'] = 'config.xml'
+        self.variables['viewer_threshold'] = 8 << 20  # Files larger than this (bytes) open in a read-only paged view
+        self.variables['config'] = self.ConfigStore(None)  # In memory until config_file is read
+        self.variables['mod_manifest'] = 'mod_manifest.json'  # Metadata of the mods, see ModRegistry
+        self.variables['mod_registry'] = None
         self.variables['style'] = Style()
 
-        self.variables['instance_changes'] = []
         self.variables['children'] = {}  # Hooks to users
         self.variables['mod_list'] = OrderedDict()  # List of attached mods
         self.variables['font_colors'] = {}
         self.variables['colors'] = {}
-        self.variables['icons'] = {}
+        self.variables['icons'] = self.LazyDict(self.__load_icon)
+        self.variables['icon_sizes'] = {}
+        self.variables['deferred_icons'] = []  # Widgets waiting for their icon until the window is shown
         self.variables['init_summary'] = []
+        self.variables['is_initialized'] = False
+        self.variables['is_shown'] = False
+        self.variables['pending_mods'] = []  # Enabled mods not imported yet, in lazy mode
         self.variables['user_variables'] = {}  # Variable passed to users
 
     def __link_user_variables(self, user_variables):
@@ -126,7 +166,15 @@ class TacoShell:
 
     def __on_closing(self):
         """Define Tkinter instance close event"""
-        self.__save_as_xml()
+        try:
+            self.__store_window()
+            self.variables['config'].save()
+        except:
+            self.print_error()
+        for key in ('log_flush_id', 'worker_poll_id'):
+            if self.variables[key] is not None:
+                self.root_window.after_cancel(self.variables[key])
+        self.components['STOP_COMMAND'] = True  # Let a running command end
         if 'window_flags' in self.components.keys():
             self.components['window_flags'].destroy()
         self.root_window.destroy()
@@ -175,18 +223,49 @@ class TacoShell:
                  {'name': 'debug_off', 'size': (30, 15)},
                  {'name': 'next', 'size': default_mini_icon_size},
                  {'name': 'previous', 'size': default_mini_icon_size}]
-        missing_icons = []
+        for icon in icons:  # Loaded when first used, see __load_icon
+            self.variables['icon_sizes'][icon['name']] = icon['size']
 
-        for icon in icons:
-            try:
-                self.variables['icons'][icon['name']] = PhotoImage(
-                    Image.open(self.directory + 'resources/' + icon['name'] + '.png').resize(icon['size'], ANTIALIAS))
-            except FileNotFoundError:
-                self.variables['icons'][icon['name']] = PhotoImage(Image.new("RGB", icon['size'], "white"))
-                missing_icons.append(icon['name'] + '.png')
+    def __with_icon(self, widget, name):
+        """Give a widget an icon, right away once the window is shown, else when it is (see __show_icons)"""
+        if self.variables['is_shown']:
+            widget.configure(image=self.variables['icons'][name])
+        else:
+            self.variables['deferred_icons'].append((widget, name))
+        return widget
+
+    def __show_icons(self):
+        """Load the icons (and PIL) after the first paint and put them on the widgets waiting for them"""
+        self.variables['is_shown'] = True
+        for widget, name in self.variables['deferred_icons']:
+            widget.configure(image=self.variables['icons'][name])
+        del self.variables['deferred_icons'][:]
+
+    def __load_icon(self, name):
+        """Load an icon the first time it is used"""
+        icon, found = self.load_icon(name, self.variables['icon_sizes'][name])
+        if not found:
+            message = 'Missing icon in resources/ folder: ' + name + '.png'
+            if self.variables['is_initialized']:
+                self.write_to_log(message, 'bad')
+            else:
+                self.variables['init_summary'].append(message)
+        return icon
+
+    @staticmethod
+    def load_icon(name, size):
+        """
+        Load and resize an icon from resources/, importing PIL on first use.
 
-        if missing_icons:
-            self.variables['init_summary'].append('Missing icon(s) in resources/ folder: ' + ', '.join(missing_icons))
+        :return: The image, white if the file is missing, and whether the file was found
+        """
+        from PIL.ImageTk import PhotoImage
+        from PIL.Image import ANTIALIAS
+        from PIL import Image
+        try:
+            return PhotoImage(Image.open(TacoShell.directory + 'resources/' + name + '.png').resize(size, ANTIALIAS)), True
+        except FileNotFoundError:
+            return PhotoImage(Image.new("RGB", size, "white")), False
 
     def __init_theme(self):
         """Initialize theme"""
@@ -296,11 +375,10 @@ class TacoShell:
 
     def __set_flags(self, v):
         """Update flags according to specified in flag settings"""
-        for i, [_, w] in enumerate(self.components['packing'].items()):
+        for i, [k, w] in enumerate(self.components['packing'].items()):
             w['flag'] = True if v[i].get() in ('True', 'True(default)') else False
+            self.variables['config'].set('flags', k, w['flag'])
         self.__repack()
-        if 'flags_changed' not in self.variables['instance_changes']:
-            self.variables['instance_changes'].append('flags_changed')
 
     def __open_tool_window(self, window_key, mem, title='tool', table=None, actions: list = None):
         """Generic tool window"""
@@ -362,6 +440,11 @@ class TacoShell:
         description = Frame(row)
         Label(description, text=name).pack(side=TOP)
         # TODO: Consider changing the extra info is added (flag specific)
+        if obj.get('title'):
+            TkLabel(description,
+                    fg=self.variables['font_colors']['highlighted'],
+                    bg=self.variables['colors']['milddark'],
+                    text=obj['title']).pack(side=TOP, anchor='w')
         if 'kwargs' in obj.keys():
             if 'side' in obj['kwargs'].keys():
                 TkLabel(description,
@@ -374,13 +457,22 @@ class TacoShell:
 
     def __collect_mods(self):
         """Checks /mod folder for any mods and adds them"""
-        if not os.path.isdir('mods'):
-            os.makedirs('mods')
-        for file in os.listdir(os.getcwd() + '/mods'):
-            name, ext = os.path.splitext(file)
-            if ext in ('.py', '.pyc'):
-                flag = {'flag': False, 'default': False}
-                self.variables['mod_list'][name] = flag
+        if self.variables['mod_registry'] is None:
+            self.variables['mod_registry'] = self.ModRegistry('mods', self.variables['mod_manifest'])
+        registry = self.variables['mod_registry']
+        registry.refresh()
+        for name, record in registry.items():
+            mod = self.variables['mod_list'].setdefault(name, {'flag': False, 'default': False})
+            mod['title'] = record['title']
+
+    def __open_mods(self, mem):
+        """Open the mods window, with mods added since the last time"""
+        self.__collect_mods()
+        self.__open_tool_window(window_key='window_mods',
+                                mem=mem,
+                                title='mods',
+                                table=self.variables['mod_list'],
+                                actions=[{'text': 'set', 'command': lambda: self.__set_mods(mem)}])
 
     def __set_mods(self, v):
         """Connect to a soft-specified mod"""
@@ -390,138 +482,144 @@ class TacoShell:
                 self.__get_ingredients(k, d)
             else:
                 self.variables['mod_list'][k]['flag'] = False
+            self.variables['config'].set('mods', k, self.variables['mod_list'][k]['flag'])
 
     def __provide_child_id(self):
         """Provide hooked mod an ID"""
         self.variables['next_child_id'] += 1
         return str(self.variables['next_child_id'])
 
-    def __get_ingredients(self, name, mod):
+    def __get_ingredients(self, name, mod, repack=True):
         """Initialize mods, create hooks"""
         child_id = self.__provide_child_id()
+        profile = self.variables['startup_profile']
+        start = perf_counter()
         try:
-            # TODO: Add support for .pyc
-            # https://stackoverflow.com/questions/67631/how-to-import-a-module-given-the-full-path
-            module = import_module('.' + name, 'mods')
-            instance = module.make_taco()
+            registry = self.variables['mod_registry']
+            module = registry.load(name)
+            imported = perf_counter() - start
+            entry = registry[name]['entry']
+            if entry is None:
+                raise AttributeError('Mod ' + name + ' has no ' + registry.entry_point + '()')
+            instance = getattr(module, entry)()
+            components, title = dict(self.components), self.root_window.title()
             self.variables['children'][child_id] = instance
             self.variables['children'][child_id].eat_taco(self, child_id)
+            if profile is not None:
+                self.variables['startup_mods'][name] = (imported, perf_counter() - start)
+            registry.learn(name,
+                           title=self.root_window.title() if self.root_window.title() != title
+                           else registry[name]['title'],
+                           components=[key for key, value in self.components.items()
+                                       if components.get(key) is not value])
+            mod['title'] = registry[name]['title']
             self.write_to_log("Added " + name + " to taco")
-            self.__repack()
+            if repack:
+                self.__repack()
 
         except:
             self.print_error()
-            print("Failed to add ingredient " + mod['name'])
-
-    @staticmethod
-    def __bool(string):
-        """Convert a string representation of boolean to boolean"""
-        return True if string == 'True' else False
+            print("Failed to add ingredient " + name)
 
     def __interpret_xml_config(self):
         """Read program configuration from XML"""
-        try:
-            if not os.path.isfile(self.variables['config_file']):
-                return
-
-            tree = ElementTree.parse(self.variables['config_file'])
+        config = self.variables['config'] = self.ConfigStore(self.variables['config_file'],
+                                                             after=self.root_window.after,
+                                                             after_cancel=self.root_window.after_cancel)
+        for error in config.errors:
+            self.variables['init_summary'].append('Ignored in ' + config.file + ': ' + error)
 
+        try:
             # Read mods (Before flags)
-            mod_node = tree.find('mods')
-            for child in mod_node:
-                name = child.tag
-                mod = {'flag': self.__bool(child.text), 'default': False}
-                self.variables['mod_list'][name] = mod
+            for name, flag in config.section('mods').items():
+                mod = self.variables['mod_list'].setdefault(name, {'flag': False, 'default': False})
+                mod['flag'] = flag
                 if mod['flag']:
-                    self.__get_ingredients(name, mod)
+                    if self.variables['lazy_mods']:
+                        self.variables['pending_mods'].append((name, mod))
+                    else:
+                        self.__get_ingredients(name, mod, repack=False)  # Repacked once initialized
 
             # Read flags
             c = self.components['packing']
             for key in c.keys():
-                node = tree.find('flags/' + key)
-                c[key]['flag'] = self.__bool(node.text) if node is not None else c[key]['default']
+                c[key]['flag'] = config.get('flags', key, c[key]['default'])
 
             # Read path
-            path_child = tree.find('paths/entry_path_text')
-            if path_child is not None:
-                self.components['entry_path_text'].set(path_child.text)
-                if os.path.isfile(self.components['entry_path_text'].get()):
+            path = config.get('paths', 'entry_path_text')
+            if path is not None:
+                self.components['entry_path_text'].set(path)
+                if self.source_exists(self.components['entry_path_text'].get()):
                     self.components['btn_generate'].config(state='normal')
 
             # Read window settings
-            x = tree.find('window/window_x').text
-            y = tree.find('window/window_y').text
-            width = tree.find('window/window_width').text
-            height = tree.find('window/window_height').text
-            self.components['window_dimensions'] = [x, y, width, height]
+            window = config.section('window')
+            if all(key in window for key in ('window_x', 'window_y', 'window_width', 'window_height')):
+                self.components['window_dimensions'] = [window['window_x'], window['window_y'],
+                                                        window['window_width'], window['window_height']]
 
         except:
             self.print_error(True)
 
-    def __save_as_xml(self):
-        """Create data structure for saving to XML"""
-        flag_data = []
-        for item in self.variables['instance_changes']:
-            if item == 'flags_changed':
-                response = messagebox.askyesno("Unsaved flag changes",
-                                               "Save flag settings?")
-                if response:
-                    for k, v in self.components['packing'].items():
-                        flag_data.append({'tag': k, 'value': v['flag']})
-
-        mod_data = []
-        for k, d in self.variables['mod_list'].items():
-            mod_data.append({'tag': k, 'value': d['flag']})
-
-        path_data = []
-        if os.path.isfile(self.components['entry_path_text'].get()):
-            path_str = self.components['entry_path_text'].get()
-            path_data.append({'tag': 'entry_path_text', 'value': path_str})
-
-        window_data = [{'tag': 'window_width', 'value': self.root_window.winfo_width()},
-                       {'tag': 'window_height', 'value': self.root_window.winfo_height()},
-                       {'tag': 'window_x', 'value': self.root_window.winfo_x()},
-                       {'tag': 'window_y', 'value': self.root_window.winfo_y()}]
-
-        save_data = [
-            {'tag': 'mods', 'elements': mod_data},
-            {'tag': 'flags', 'elements': flag_data},
-            {'tag': 'paths', 'elements': path_data},
-            {'tag': 'window', 'elements': window_data}
-        ]
-        self.__write_xml('config.xml', save_data)
+        # Store changes as they happen, saved by the config store shortly after
+        self.components['entry_path_text'].trace('w', lambda *_: self.__store_path())
+        self.root_window.bind('<Configure>', self.__store_window, add='+')
 
-    @staticmethod
-    def __write_xml(file, data: list = None):
-        """Partly generic method for writing XML"""
-        if os.path.isfile(file):
-            try:
-                tree = ElementTree.parse(file)
-                root = tree.getroot()
+    def __store_path(self):
+        """Remember the source path once it exists"""
+        path = self.components['entry_path_text'].get()
+        if self.source_exists(path):
+            self.variables['config'].set('paths', 'entry_path_text', path)
 
-            except:
-                root = ElementTree.Element('root')
-
-        else:
-            root = ElementTree.Element('root')
-
-        for element in data:
-            child = root.find(element['tag'])
-            if child is None:
-                child = ElementTree.SubElement(root, element['tag'])
-
-            for data_element in element['elements']:
-                sub_child = root.find(element['tag'] + '/' + data_element['tag'])
-                if sub_child is None:
-                    sub_child = ElementTree.SubElement(child, data_element['tag'])
-
-                sub_child.text = str(data_element['value'])
+    def __store_window(self, event=None):
+        """Remember the size and position of the main window"""
+        if event is not None and event.widget is not self.root_window:
+            return
+        config = self.variables['config']
+        config.set('window', 'window_width', self.root_window.winfo_width())
+        config.set('window', 'window_height', self.root_window.winfo_height())
+        config.set('window', 'window_x', self.root_window.winfo_x())
+        config.set('window', 'window_y', self.root_window.winfo_y())
+
+    def __after_startup(self):
+        """Once the window is shown: load the icons and the mods left for later, then report the startup profile"""
+        self.root_window.update_idletasks()
+        profile = self.variables['startup_profile']
+        if profile is not None:
+            profile['window shown'] = perf_counter() - self.variables['startup_time']
+        for phase, step in (('icons', self.__show_icons), ('pending mods', self.__load_pending_mods)):
+            start = perf_counter()
+            step()
+            if profile is not None:
+                profile[phase] = profile.get(phase, 0) + perf_counter() - start
+        if profile is not None:
+            self.__report_startup(profile)
+
+    def __load_pending_mods(self):
+        """Add the enabled mods that were not imported yet, in lazy mode"""
+        if not self.variables['pending_mods']:
+            return
+        pending, self.variables['pending_mods'] = self.variables['pending_mods'], []
+        for name, mod in pending:
+            self.__get_ingredients(name, mod, repack=False)
+        self.__repack()
 
-        xml_str = str(ElementTree.tostring(root), 'utf-8').replace('\n', '').replace('\t', '').encode('utf-8')
-        pretty_xml = parseString(xml_str).toprettyxml(newl='\n', indent="\t")
-        with open(file, 'w+') as f:
-            f.write(pretty_xml)
-            f.close()
+    def __report_startup(self, profile):
+        """Print and log the time spent per startup phase"""
+        lines = ['Window shown after {:.1f} ms'.format(profile['window shown'] * 1000)]
+        for phase, seconds in profile.items():
+            if phase == 'window shown':
+                lines.append('After the window was shown:')
+            else:
+                lines.append('  {:<28}{:>9.1f} ms'.format(phase, seconds * 1000))
+        if self.variables['startup_mods']:
+            lines.append('Mods, part of the phases above:')
+            for name, (imported, total) in self.variables['startup_mods'].items():
+                lines.append('  {:<28}{:>9.1f} ms, of which importing {:.1f} ms'.format(name, total * 1000,
+                                                                                      imported * 1000))
+        for line in lines:
+            print(line)
+            self.write_to_log(line, 'debug')
 
     def __display_initialization_summary(self):
         """If notable items occur during initialization, this function will display them in the GUI"""
@@ -551,13 +649,7 @@ class TacoShell:
                                 actions=[{'text': 'set', 'command': lambda: self.__set_flags(mem1)}]))
 
         mem2 = []
-        menubar.add_command(label="mods",
-                            command=lambda: self.__open_tool_window(
-                                window_key='window_mods',
-                                mem=mem2,
-                                title='mods',
-                                table=self.variables['mod_list'],
-                                actions=[{'text': 'set', 'command': lambda: self.__set_mods(mem2)}]))
+        menubar.add_command(label="mods", command=lambda: self.__open_mods(mem2))
 
         menubar.add_cascade(label="?", menu=menu_options)
         self.root_window.config(menu=menubar)
@@ -604,11 +696,11 @@ class TacoShell:
                             text="debug",
                             font='semi-bold')
         btn_debug = TkButton(panel_debug,
-                             image=self.variables['icons']['debug_off'],
                              bg=self.variables['colors']['milddark'],
                              activebackground=self.variables['colors']['milddark'],
                              borderwidth=0,
                              command=self.__toggle_debug)
+        self.__with_icon(btn_debug, 'debug_off')
 
         lbl_debug.pack(side=TOP)
         btn_debug.pack(side=BOTTOM)
@@ -620,11 +712,11 @@ class TacoShell:
                                text="override",
                                font='semi-bold')
         btn_override = TkButton(panel_override,
-                                image=self.variables['icons']['switch_off'],
                                 bg=self.variables['colors']['milddark'],
                                 activebackground=self.variables['colors']['milddark'],
                                 borderwidth=0,
                                 command=self.__toggle_override)
+        self.__with_icon(btn_override, 'switch_off')
 
         lbl_override.pack(side=TOP)
         btn_override.pack(side=BOTTOM)
@@ -641,7 +733,7 @@ class TacoShell:
     def __toggle_debug(self):
         """Toggle debugging"""
         if self.variables['DEBUG_MODE'].get():
-            if not os.path.isfile(self.components['entry_path'].get()):
+            if not self.source_exists(self.components['entry_path'].get()):
                 self.components['btn_generate'].config(state='disabled')
             self.components['txt_log'].config(state='disabled')
             self.variables['DEBUG_MODE'].set(False)
@@ -707,9 +799,9 @@ class TacoShell:
         frame_source = Frame(self.root_frame)
         self.components['entry_path_text'] = StringVar()
         entry_path = Entry(frame_source, textvariable=self.components['entry_path_text'])
-        btn_set_directory = self.ShellButton(frame_source,
-                                             image=self.variables['icons']['browse_excel'],
-                                             command=lambda: self.__browse_file(entry_path))
+        btn_set_directory = self.__with_icon(self.ShellButton(frame_source,
+                                                              command=lambda: self.__browse_file(entry_path)),
+                                             'browse_excel')
         entry_path.bind(sequence='<KeyRelease>', func=self.__path_keypress)
 
         btn_set_directory.pack(side=LEFT, padx=5, pady=5)
@@ -723,20 +815,18 @@ class TacoShell:
         """Evaluate entered path"""
         if not self.variables['DEBUG_MODE'].get():
             self.components['btn_generate'].config(
-                state='normal' if os.path.isfile(self.components['entry_path'].get()) else 'disabled')
+                state='normal' if self.source_exists(self.components['entry_path'].get()) else 'disabled')
 
     def __init_frame_generate(self):
         """Initialize generate frame"""
         frame_generate = Frame(self.root_frame)
-        btn_generate = self.ShellButton(frame_generate,
-                                        image=self.variables['icons']['play'],
-                                        state='disabled',
-                                        command=self.__generate_command)
+        btn_generate = self.__with_icon(self.ShellButton(frame_generate,
+                                                         state='disabled',
+                                                         command=self.__generate_command), 'play')
 
-        btn_stop = self.ShellButton(frame_generate,
-                                    image=self.variables['icons']['stop'],
-                                    state='disabled',
-                                    command=self.__stop_command)
+        btn_stop = self.__with_icon(self.ShellButton(frame_generate,
+                                                     state='disabled',
+                                                     command=self.__stop_command), 'stop')
 
         lbl_generate = Label(frame_generate, text='Generate', font='semi-bold')
 
@@ -756,7 +846,14 @@ class TacoShell:
         self.components['STOP_COMMAND'] = True
 
     def __generate_command(self):
-        """Wrap the soft-hooked command"""
+        """Run the soft-hooked command"""
+        self.__load_pending_mods()
+        self.run_command(self.components['btn_generate_command'])
+
+    def run_command(self, command):
+        """Run a command with progress, log and stop handling, on a worker thread if it is marked threaded"""
+        if self.variables['is_processing']:
+            return
         c = self.components
         c['STOP_COMMAND'] = False
         c['btn_stop'].configure(state='normal')
@@ -764,32 +861,97 @@ class TacoShell:
         c['lbl_progress'].config(text='Processing')
         self.__clear_log()
         self.write_to_log('Started processing', 'good')
-        self.components['txt_log'].update()
-        self.components['count_failed'] = 0
-        start_time = c['start_time'] = c['last_update'] = time()
+        self.flush_log()
+        c['count_failed'] = 0
+        c['progress_value'] = c['progress_maximum'] = 0
+        c['progress_force'] = False
+        c['start_time'] = c['last_update'] = time()
+        self.variables['is_processing'] = True
+        self.variables['command_inputs'] = {'entry_path': c['entry_path'].get(),
+                                            'DEBUG_MODE': self.variables['DEBUG_MODE'].get(),
+                                            'OVERRIDE': self.variables['OVERRIDE']}
+
+        if getattr(command, 'threaded', False):
+            worker = threading.Thread(target=self.__run_command, args=(command,), daemon=True)
+            worker.start()
+        else:  # Commands that use Tk themselves must stay on the main thread
+            self.__run_command(command)
+        self.__poll_worker()
 
+    @staticmethod
+    def threaded(command):
+        """
+        Mark a command (a function or a bound method) to run on a worker thread. It must not touch Tk, other than
+        through write_to_log and update_progress; inputs are in variables['command_inputs'].
+        """
+        @wraps(command)
+        def run(*args, **kwargs):
+            return command(*args, **kwargs)
+        run.threaded = True
+        return run
+
+    def __run_command(self, command):
+        """Command body, reports completion through the worker queue"""
+        result = error = None
         try:
-            result = c['btn_generate_command']()
+            result = command()
+        except BaseException as e:
+            error = e
+        finally:
+            self.variables['worker_queue'].put(('done', result, error))
+
+    def __poll_worker(self):
+        """Drain the worker queue and refresh progress, rescheduled with after() while a command runs"""
+        self.variables['worker_poll_id'] = None
+        worker_queue = self.variables['worker_queue']
+        delay = int(self.variables['progress_update_cycle'] * 1000)
+        for _ in range(self.variables['worker_poll_limit']):  # Keep the window responsive to a chatty worker
+            try:
+                event = worker_queue.get_nowait()
+            except Empty:
+                break
+            if event[0] == 'log':
+                self.write_to_log(*event[1:])
+            elif event[0] == 'done':
+                self.__finish_command(*event[1:])
+                return
+        else:
+            delay = 1  # Limit reached, continue right after the window has been redrawn
+
+        self.__refresh_progress()
+        self.flush_log()
+        self.variables['worker_poll_id'] = self.root_window.after(delay, self.__poll_worker)
+
+    def __finish_command(self, result, error):
+        """Report the outcome of a command, on the main thread"""
+        c = self.components
+        self.variables['is_processing'] = False
+        self.__summarize_muted()
+        c['btn_stop'].configure(state='disabled')
+        c['btn_generate'].configure(state='normal')
+        if error is None:
             if result is not None:
                 for line in result:
                     self.write_to_log(str(line), timestamp=False)
 
-            self.write_to_log('Finished processing in {} seconds\n'.format(str(time() - start_time)), 'good')
-            if not self.components['STOP_COMMAND']:
-                c['bar_progress']['value'] = c['bar_progress']['maximum']
+            self.write_to_log('Finished processing in {} seconds\n'.format(str(time() - c['start_time'])), 'good')
+            if c['progress_maximum']:  # Leave the bar alone for commands that never reported progress
+                c['progress_force'] = True
+                self.__refresh_progress()
+                if not c['STOP_COMMAND']:
+                    c['bar_progress']['value'] = c['bar_progress']['maximum']
             c['lbl_progress'].config(text='Completed')
-            c['btn_stop'].configure(state='disabled')
-            c['btn_generate'].configure(state='normal')
+            self.flush_log()
 
-        except Exception as e:
-            self.write_to_log('Stopped code execution due to error\n'.format(str(time() - start_time)), 'bad')
-            c['btn_stop'].configure(state='disabled')
-            c['btn_generate'].configure(state='normal')
+        else:
+            self.write_to_log('Stopped code execution due to error\n', 'bad')
             c['lbl_progress'].config(text='Error')
-            c['txt_log'].yview_moveto(1)
-            raise e
+            self.flush_log()
+            raise error
 
     def __clear_log(self):
+        del self.variables['log_queue'][:]
+        self.variables['muted_counters'].clear()
         txt = self.components['txt_log']
         txt.config(state='normal')
         txt.delete('1.0', END)
@@ -810,6 +972,10 @@ class TacoShell:
         bar_progress.pack(side=RIGHT, fill=X, pady=5, expand=YES)
 
         self.components['count_failed'] = 0  # Counter for loops that that were expected but that were skipped
+        self.components['progress_value'] = 0  # Progress recorded by update_progress, shown by __refresh_progress
+        self.components['progress_maximum'] = 0
+        self.components['progress_force'] = False
+        self.components['start_time'] = self.components['last_update'] = time()
         self.components['var_estimated_time_remaining'] = var_est
         self.components['frame_progress'] = frame_progress
         self.components['lbl_progress'] = lbl_progress  # TODO change labels to StringVar()
@@ -830,14 +996,14 @@ class TacoShell:
                                       background=self.variables['colors']['dark'],
                                       foreground=self.variables['font_colors']['normal'],
                                       insertbackground=self.variables['font_colors']['normal'],
-                                      state='disabled')
+                                      state='disabled',
+                                      set_icon=self.__with_icon)
 
         for key, color in self.variables['font_colors'].items():
             txt_log.tag_configure(key, foreground=color)
 
         frame_open = Frame(tab_control)
-        btn_open = self.ShellButton(frame_open, image=self.variables['icons']['browse'],
-                                    command=self.__open_definition)
+        btn_open = self.__with_icon(self.ShellButton(frame_open, command=self.__open_definition), 'browse')
 
         btn_open.place(relx=0.5, rely=0.5, anchor=CENTER)
 
@@ -859,11 +1025,12 @@ class TacoShell:
 
     def __open_definition(self):
         """Open a file in a tab"""
+        self.__load_pending_mods()
         files = self.components['btn_open_definition_command']()
         for file in list(files):
             tab_control: Notebook = self.components['tab_control']
             new_tab = Frame(tab_control)
-            name, _ = os.path.basename(file).split('.')
+            name, _ = os.path.splitext(os.path.basename(file))
             tab_control.insert(tab_control.index(END) - 1, new_tab, text=name)
             self.components['tabs'].append(new_tab)
             tab_control.select(tab_control.index(END) - 2)
@@ -872,7 +1039,8 @@ class TacoShell:
                                                wrap='none',
                                                background=self.variables['colors']['dark'],
                                                foreground=self.variables['font_colors']['normal'],
-                                               insertbackground=self.variables['font_colors']['normal'])
+                                               insertbackground=self.variables['font_colors']['normal'],
+                                               set_icon=self.__with_icon)
 
             button_panel = Frame(new_tab)
             btn_close = self.ShellButton(button_panel, image=self.variables['icons']['close'],
@@ -880,6 +1048,15 @@ class TacoShell:
 
             lbl_status = Label(button_panel)
 
+            if os.path.getsize(file) > self.variables['viewer_threshold']:
+                # Too large to edit, only the lines around the view are loaded
+                self.PagedText(txt_contents, file, lbl_status)
+                btn_close.pack(side=RIGHT, padx=5)
+                lbl_status.pack(side=LEFT, padx=5)
+                button_panel.pack(side=TOP, fill=X, pady=(5, 0))
+                txt_contents.pack(side=BOTTOM, fill=BOTH, expand=YES)
+                continue
+
             btn_save = self.ShellButton(button_panel, image=self.variables['icons']['save'],
                                         command=lambda: self.__save_tab_contents(txt_contents, file, lbl_status))
 
@@ -897,9 +1074,8 @@ class TacoShell:
             button_panel.pack(side=TOP, fill=X, pady=(5, 0))
             txt_contents.pack(side=BOTTOM, fill=BOTH, expand=YES)
 
-            f = open(file, 'r')
-            for line in f.readlines():
-                txt_contents.insert('end', line)
+            with open(file, 'r') as f:
+                txt_contents.insert('end', f.read())
 
     def __close_tab(self, tab_control):
         """Close a tab"""
@@ -923,10 +1099,8 @@ class TacoShell:
     def __reset_tab_contents(widget, file, label):
         """Reset changes done in file back to file"""
         widget.delete('1.0', 'end')
-        f = open(file, 'r')
-        for line in f.readlines():
-            widget.insert('end', line)
-        f.close()
+        with open(file, 'r') as f:
+            widget.insert('end', f.read())
         label.configure(text='reverted')
 
     @staticmethod
@@ -952,38 +1126,12 @@ class TacoShell:
                 self.components['entry_path_text'].set(response)
                 self.components['btn_generate'].config(state='normal')
 
-    @staticmethod
-    def interpret_file(file, delimiter=None, quotechar=None, buffermode=''):
-        """Interpret .csv"""
-        raw_file = open(file, 'r', newline='')
-        eval_buffer = []
-        index = 0  # This will return as a count
-        for index, line in enumerate(raw_file.readlines()):
-            strip_line = line.strip(' \t\r\n')
-            if strip_line[0] != '@':
-                eval_buffer.append(strip_line)
-
-        kwargs = {'delimiter': delimiter,
-                  'skipinitialspace': True}
-        if quotechar is None:
-            kwargs['quoting'] = csv.QUOTE_NONE
-        else:
-            kwargs['quotechar'] = quotechar
-        csv_interator = csv.reader(eval_buffer, **kwargs)
-
-        if buffermode == 'list':
-            # Returns a buffer in the form of a list instead of iterator
-            out_buffer = [line for line in csv_interator]
-            interpretation = out_buffer
-        elif buffermode == 'dict':
-            # Returns a buffer in the form of a dict with the first index element as key and the second as value
-            # Requires return from iterator to be exactly two values
-            out_buffer = {key: value for key, value in csv_interator}
-            interpretation = out_buffer
-        else:
-            interpretation = csv_interator
+    interpret_file = staticmethod(tacofiles.interpret_file)
 
-        return interpretation, index
+    @staticmethod
+    def source_exists(path):
+        """Whether a source path names a file, a directory or files matching a glob pattern"""
+        return os.path.exists(path) or bool(glob.glob(path))
 
     @staticmethod
     def get_timestamp(file_friendly=False):
@@ -993,45 +1141,99 @@ class TacoShell:
         else:
             return datetime.now().strftime('%Y.%m.%d %H:%M')
 
-    def update_progress(self, failed=False, force=False):
-        """Update progress frame elements through hook"""
+    def update_progress(self, failed=False, force=False, value=None, maximum=None):
+        """Record progress through hook, displayed by the main loop. Safe to call from the command worker"""
+        c = self.components
+        if failed:
+            c['count_failed'] += int(failed)  # True or a number of failed items
+        if value is not None:
+            c['progress_value'] = value
+        if maximum is not None:
+            c['progress_maximum'] = maximum
+        if force:
+            c['progress_force'] = True
+        if self.variables['is_processing'] and threading.current_thread() is threading.main_thread():
+            # A command on the main thread blocks the main loop, so repaint and handle Stop from here
+            if self.__refresh_progress():
+                self.flush_log()
+                self.root_window.update()
+
+    def __refresh_progress(self):
+        """Update progress frame elements from recorded progress, returns whether they were updated"""
         current_time = time()
         start_time = self.components['start_time']
         delta_update = current_time - self.components['last_update']
         delta_start = current_time - start_time
-        maximum = self.components['bar_progress']['maximum']
-        value = self.components['bar_progress']['value']
+        maximum = self.components['progress_maximum']
+        value = self.components['progress_value']
         update = False
-        if failed:
-            self.components['count_failed'] += 1
         count_failed = self.components['count_failed']
         num = delta_start * (maximum - count_failed)
         det = (value - count_failed)
         estimated_time_remaining = round(num / det - delta_start) if 0 < det else 0
 
-        if force:
+        if self.components['progress_force']:
             update = True
+            self.components['progress_force'] = False
         else:
             if self.variables['progress_update_cycle'] < delta_update:
                 if estimated_time_remaining < 30 or 1 < delta_update or delta_start < 10:
                     update = True
-        if update:
+        if update and maximum:  # Nothing recorded, keep showing the last command's progress
             self.components['var_estimated_time_remaining'].set('{}s'.format(estimated_time_remaining))
-            self.components['bar_progress'].update()  # ~25% processing time cost for blockgenerator
+            self.components['bar_progress'].configure(maximum=maximum, value=value)
             self.components['last_update'] = current_time
             self.components['lbl_progress'].configure(text='{}/{}'.format(value, maximum))
+            return True
+        return False
 
     def write_to_log(self, text, font='normal', timestamp=True):
-        """Print to GUI txt_log"""
+        """Queue text for GUI txt_log, inserted in bulk by flush_log. Safe to call from the command worker"""
+        text = ''.join(text)
+        if threading.current_thread() is not threading.main_thread():
+            self.variables['worker_queue'].put(('log', text, font, timestamp))
+            return
+
+        if font == 'muted' and self.variables['is_processing']:
+            # Collapse repeated muted messages into counters, summarized when processing ends
+            counters = self.variables['muted_counters']
+            counters[text] = counters.get(text, 0) + 1
+            return
+
+        queue = self.variables['log_queue']
+        if font in ('normal', 'good') and timestamp:
+            queue.append(self.get_timestamp() + ':\t')
+            queue.append('highlighted')
+        queue.append(text + '\n')
+        queue.append(font)
+        if self.variables['log_flush_id'] is None:
+            self.variables['log_flush_id'] = self.root_window.after(self.variables['log_flush_cycle'], self.flush_log)
+
+    def flush_log(self):
+        """Insert all queued text into txt_log in one go"""
+        if self.variables['log_flush_id'] is not None:
+            self.root_window.after_cancel(self.variables['log_flush_id'])
+            self.variables['log_flush_id'] = None
+        queue = self.variables['log_queue']
+        if not queue:
+            return
+
         txt: Text = self.components['txt_log']
         txt.config(state='normal')
-        if font in ('normal', 'good') and timestamp:
-            txt.insert('end', self.get_timestamp() + ':\t', 'highlighted')
-        txt.insert('end', ''.join(text) + '\n', font)
+        txt.insert('end', *queue)
+        del queue[:]
         if not self.variables['DEBUG_MODE'].get():
             txt.config(state='disabled')
         txt.yview_moveto(1)
 
+    def __summarize_muted(self):
+        """Write one line per collapsed muted message"""
+        counters = self.variables['muted_counters']
+        for text, count in counters.items():
+            self.variables['log_queue'].extend((text + ('' if count == 1 else ' ({}x)'.format(count)) + '\n',
+                                                'muted'))
+        counters.clear()
+
     def print_error(self, suppress_from_gui=False):
         logging.exception("message")
         formatted_lines = traceback.format_exc()
@@ -1058,28 +1260,23 @@ class TacoShell:
             self.configure(bg=self.color_leave)
 
     class ScrollableText(Text):
-        def __init__(self, parent, *args, **kwargs):
+        def __init__(self, parent, *args, set_icon=None, **kwargs):
+            """:param set_icon: Gives a widget an icon by name, e.g. when the icons are loaded; loads them now if None"""
+            if set_icon is None:
+                def set_icon(widget, name):
+                    widget.image, _ = TacoShell.load_icon(name, (20, 20))
+                    widget.configure(image=widget.image)
+
             # Add search field
             search_handle = Frame(parent)
-            # TODO get image as in parameter
-            try:
-                im_next = PhotoImage(Image.open('resources/next.png').resize((20, 20), ANTIALIAS))
-            except FileNotFoundError:
-                im_next = PhotoImage(Image.new("RGB", (20, 20), "white"))
-            try:
-                im_prev = PhotoImage(Image.open('resources/previous.png').resize((20, 20), ANTIALIAS))
-            except FileNotFoundError:
-                im_prev = PhotoImage(Image.new("RGB", (20, 20), "white"))
 
             # TODO add correct handles for func=
-            TacoShell.ShellButton(search_handle,
-                                  image=im_next,
-                                  command=self.__search_next
-                                  ).pack(side=RIGHT, padx=5)
-            TacoShell.ShellButton(search_handle,
-                                  image=im_prev,
-                                  command=self.__search_previous
-                                  ).pack(side=RIGHT, padx=[5, 0])
+            btn_next = TacoShell.ShellButton(search_handle, command=self.__search_next)
+            btn_prev = TacoShell.ShellButton(search_handle, command=self.__search_previous)
+            set_icon(btn_next, 'next')
+            set_icon(btn_prev, 'previous')
+            btn_next.pack(side=RIGHT, padx=5)
+            btn_prev.pack(side=RIGHT, padx=[5, 0])
             entry_search = Entry(search_handle, width=10)
             entry_search.pack(side=RIGHT, padx=[5, 0])
             Label(search_handle, text='Search').pack(side=RIGHT)
@@ -1110,6 +1307,7 @@ class TacoShell:
                  'kwargs': {'side': LEFT, 'fill': BOTH, 'expand': YES, 'padx': 5, 'pady': 5}}]
 
             self.entry_search = entry_search
+            self.scrollbar_vert = scrollbar_vert
             self.text_widget = super()
             super().__init__(parent, *args, **kwargs)
             super().configure(xscrollcommand=scrollbar_hori.set)
@@ -1181,6 +1379,484 @@ class TacoShell:
                             w_['old_flag'].set(w_['flag'].get())
                     return
 
+    CsvStream = tacofiles.CsvStream  # Defined apart from the GUI, so headless tools can read files without Tk
+    MappedCsv = tacofiles.MappedCsv
+    LineIndex = tacofiles.LineIndex
+
+    class PagedText:
+        """
+        Read-only view of a large file in a ScrollableText, holding only the lines around what is shown.
+
+        Pages of lines are added at the end or the start as the view gets near them, and dropped from the other side
+        beyond `keep` pages. The vertical scrollbar spans the whole file by bytes. The line index is built while the
+        GUI is idle and only feeds the line numbers in the status label.
+        """
+
+        def __init__(self, text, file, status=None, page=200, keep=3):
+            self.text = text
+            self.status = status
+            self.page = page
+            self.keep = keep
+            self.index = TacoShell.LineIndex(file)
+            self.starts = []  # Start of every loaded line
+            self.begin = self.end = 0  # Bytes loaded
+            self.busy = False
+
+            text.configure(yscrollcommand=self.__scrolled)
+            text.scrollbar_vert.configure(command=self.yview)
+            self.__load(0, self.index.forward(0, self.page * 2))
+            text.configure(state='disabled')
+            text.bind('<Destroy>', lambda e: self.index.close(), add='+')
+            text.after_idle(self.__index_more)
+
+        def yview(self, *args):
+            """Scrollbar command: drags jump anywhere in the file, the rest scrolls the text"""
+            if args and args[0] == 'moveto':
+                position = self.index.start(min(int(float(args[1]) * self.index.size), self.index.size))
+                self.__load(self.index.backward(position, self.page), self.index.forward(position, self.page * 2))
+                self.text.yview(str(bisect_right(self.starts, position)) + '.0')
+            else:
+                self.text.yview(*args)
+
+        def __load(self, begin, end):
+            """Replace the loaded lines"""
+            self.busy = True
+            self.text.configure(state='normal')
+            self.text.delete('1.0', 'end')
+            self.text.insert('end', self.index.text(begin, end))
+            self.text.configure(state='disabled')
+            self.begin, self.end = begin, end
+            self.starts = self.index.starts(begin, end)
+            self.busy = False
+
+        def __scrolled(self, lo, hi):
+            """Text view moved: load lines near the edges, then place the scrollbar on the whole file"""
+            if not self.busy:
+                first = int(self.text.index('@0,0').split('.')[0]) - 1
+                last = int(self.text.index('@0,{}'.format(self.text.winfo_height())).split('.')[0]) - 1
+                if last > len(self.starts) - self.page // 2 and self.end < self.index.size:
+                    self.__extend_end(first)
+                elif first < self.page // 2 and self.begin > 0:
+                    self.__extend_start(first)
+                lo, hi = self.__fractions()
+            self.text.scrollbar_vert.set(lo, hi)
+            self.__show_status()
+
+        def __extend_end(self, first):
+            self.busy = True
+            end = self.index.forward(self.end, self.page)
+            self.text.configure(state='normal')
+            self.text.insert('end-1c', self.index.text(self.end, end))
+            self.starts.extend(self.index.starts(self.end, end))
+            self.end = end
+            drop = len(self.starts) - self.page * self.keep
+            if drop > 0:
+                self.text.delete('1.0', '{}.0'.format(drop + 1))
+                self.begin = self.starts[drop]
+                del self.starts[:drop]
+                self.text.yview('{}.0'.format(first - drop + 1))
+            self.text.configure(state='disabled')
+            self.busy = False
+
+        def __extend_start(self, first):
+            self.busy = True
+            begin = self.index.backward(self.begin, self.page)
+            added = self.index.starts(begin, self.begin)
+            self.text.configure(state='normal')
+            self.text.insert('1.0', self.index.text(begin, self.begin))
+            self.starts[:0] = added
+            self.begin = begin
+            drop = len(self.starts) - self.page * self.keep
+            if drop > 0:
+                self.text.delete('{}.0'.format(len(self.starts) - drop + 1), 'end-1c')
+                self.end = self.starts[-drop]
+                del self.starts[-drop:]
+            self.text.yview('{}.0'.format(first + len(added) + 1))
+            self.text.configure(state='disabled')
+            self.busy = False
+
+        def __fractions(self):
+            """Shown part of the file, by bytes"""
+            if not self.index.size:
+                return 0.0, 1.0
+            first = int(self.text.index('@0,0').split('.')[0]) - 1
+            last = int(self.text.index('@0,{}'.format(self.text.winfo_height())).split('.')[0])
+            top = self.starts[min(first, len(self.starts) - 1)] if self.starts else 0
+            bottom = self.starts[last] if last < len(self.starts) else self.end
+            return top / self.index.size, bottom / self.index.size
+
+        def __show_status(self):
+            if self.status is None or not self.starts:
+                return
+            first = int(self.text.index('@0,0').split('.')[0]) - 1
+            line = self.index.line(self.starts[min(first, len(self.starts) - 1)])
+            total = '{:,}'.format(len(self.index.lines)) if self.index.complete else \
+                '{:,}+'.format(len(self.index.lines))
+            self.status.configure(text='read-only, line {} of {}'.format(
+                '?' if line is None else '{:,}'.format(line + 1), total))
+
+        def __index_more(self):
+            """Index a chunk at a time while the tab is open"""
+            if not self.text.winfo_exists():
+                self.index.close()
+                return
+            if not self.index.extend():
+                self.text.after(10, self.__index_more)
+            self.__show_status()
+
+    class ModRegistry(OrderedDict):
+        """
+        Mods in a folder, with their metadata cached in a manifest so that listing them needs no imports.
+
+        A mod is a .py or a .pyc file, or a .zip bundle holding <name>.py or <name>.pyc. Each entry holds the file,
+        its kind, size, mtime and source hash, the entry point, the window title and the components the mod provides.
+        Entry point, title and components are read from the source where there is one, and learned when the mod is
+        added. The folder is only listed again when its mtime changes, i.e. when a file was added, removed or renamed.
+        """
+
+        version = 1
+        kinds = OrderedDict([('.py', 'py'), ('.pyc', 'pyc'), ('.zip', 'zip')])  # In order of precedence
+        entry_point = 'make_taco'
+
+        def __init__(self, path='mods', manifest=None):
+            super().__init__()
+            self.path = path
+            self.package = os.path.basename(os.path.normpath(path))
+            self.manifest = manifest
+            self.signature = None  # mtime of the folder when it was listed
+            self.hashed = 0  # Files read since the registry was created
+            self.__load()
+
+        def refresh(self):
+            """List the folder again if it changed, returns the names of new mods"""
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            signature = os.stat(self.path).st_mtime_ns
+            if signature == self.signature:
+                return []
+
+            found = {}
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    name, ext = os.path.splitext(entry.name)
+                    if ext not in self.kinds or name.startswith(('_', '.')) or not entry.is_file():
+                        continue
+                    rank = list(self.kinds).index(ext)
+                    if name not in found or rank < found[name][0]:
+                        found[name] = (rank, entry)
+
+            records = OrderedDict()
+            for name in sorted(found):
+                entry = found[name][1]
+                record = self.get(name)
+                stat = entry.stat()
+                if record is None or record['file'] != entry.name or not self.__current(record, stat):
+                    record = self.__describe(name, entry.name, stat, record)
+                records[name] = record
+
+            new = [name for name in records if name not in self]
+            self.clear()
+            self.update(records)
+            self.signature = signature
+            self.save()
+            return new
+
+        def load(self, name):
+            """Import a mod, its record is renewed first if the file changed"""
+            record = self[name]
+            file = os.path.join(self.path, record['file'])
+            stat = os.stat(file)
+            if not self.__current(record, stat):
+                record = self[name] = self.__describe(name, record['file'], stat, record)
+                self.save()
+
+            if record['kind'] != 'zip':
+                return import_module('.' + name, self.package)  # Also finds a .pyc without a source next to it
+
+            fullname = self.package + '.' + name
+            if fullname in sys.modules:
+                return sys.modules[fullname]
+            importer = zipimport.zipimporter(file)
+            if not hasattr(importer, 'find_spec'):  # Before Python 3.10
+                return importer.load_module(fullname)
+            spec = importer.find_spec(fullname)
+            if spec is None:
+                raise ImportError('{} holds no {}.py or {}.pyc'.format(file, name, name))
+            module = module_from_spec(spec)
+            sys.modules[fullname] = module
+            try:
+                spec.loader.exec_module(module)
+            except:
+                del sys.modules[fullname]
+                raise
+            return module
+
+        def learn(self, name, title, components):
+            """Store the title and components of a mod seen while it was added"""
+            record = self[name]
+            components = sorted(components)
+            if (record['title'], record['components']) != (title, components):
+                record['title'] = title
+                record['components'] = components
+                self.save()
+
+        def save(self):
+            """Write the manifest, atomically"""
+            if self.manifest is None:
+                return
+            data = {'version': self.version, 'signature': self.signature, 'mods': self}
+            part = self.manifest + '.part'
+            try:
+                with open(part, 'w') as f:
+                    json.dump(data, f, indent=1)
+                os.replace(part, self.manifest)
+            except OSError:
+                pass  # The manifest is only a cache
+
+        def __load(self):
+            if self.manifest is None or not os.path.isfile(self.manifest):
+                return
+            try:
+                with open(self.manifest, 'r') as f:
+                    data = json.load(f, object_pairs_hook=OrderedDict)
+                if data['version'] == self.version:
+                    self.update(data['mods'])
+                    self.signature = data['signature']
+            except (OSError, ValueError, KeyError):
+                pass  # Listed again
+
+        @staticmethod
+        def __current(record, stat):
+            return (record['mtime_ns'], record['size']) == (stat.st_mtime_ns, stat.st_size)
+
+        def __describe(self, name, file, stat, previous=None):
+            """Record of a mod file, keeps the metadata of the previous record if the contents are the same"""
+            with open(os.path.join(self.path, file), 'rb') as f:
+                data = f.read()
+            self.hashed += 1
+            kind = self.kinds[os.path.splitext(file)[1]]
+            record = OrderedDict([('file', file),
+                                  ('kind', kind),
+                                  ('mtime_ns', stat.st_mtime_ns),
+                                  ('size', stat.st_size),
+                                  ('hash', hashlib.sha1(data).hexdigest()),
+                                  ('entry', self.entry_point),
+                                  ('title', None),
+                                  ('components', [])])
+            if previous is not None and previous['hash'] == record['hash']:
+                for key in ('entry', 'title', 'components'):
+                    record[key] = previous[key]
+                return record
+
+            source = data if kind == 'py' else None
+            if kind == 'zip':
+                try:
+                    with zipfile.ZipFile(os.path.join(self.path, file)) as bundle:
+                        source = bundle.read(name + '.py')
+                except (KeyError, zipfile.BadZipFile):
+                    pass  # Only compiled, or not loadable at all
+            if source is not None:
+                record.update(self.inspect(source))
+            return record
+
+        @classmethod
+        def inspect(cls, source):
+            """Entry point, window title and components of a mod, read from its source without importing it"""
+            try:
+                tree = ast.parse(source)
+            except (SyntaxError, ValueError):
+                return {}
+            functions = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+            for node in tree.body:
+                if isinstance(node, ast.ClassDef):
+                    for method in node.body:
+                        if isinstance(method, ast.FunctionDef) and method.name == 'eat_taco':
+                            functions.setdefault('eat_taco', method)
+
+            info = {'entry': cls.entry_point if cls.entry_point in functions else None,
+                    'title': None,
+                    'components': []}
+            for node in ast.walk(functions['eat_taco']) if 'eat_taco' in functions else ():
+                if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) \
+                        and node.func.attr == 'title' and node.args and info['title'] is None:
+                    info['title'] = cls.__string(node.args[0])
+                elif isinstance(node, ast.Assign):
+                    for target in node.targets:
+                        if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Attribute) \
+                                and target.value.attr == 'components':
+                            key = cls.__string(target.slice)
+                            if key is not None and key not in info['components']:
+                                info['components'].append(key)
+            info['components'].sort()
+            return info
+
+        @staticmethod
+        def __string(node):
+            if isinstance(node, getattr(ast, 'Index', ())):  # Before Python 3.9
+                node = node.value
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                return node.value
+            return None
+
+    class ConfigStore:
+        """
+        Typed program configuration, kept in memory and written to XML shortly after it changed (kept in memory only
+        if file is None).
+
+        The sections in `schema` hold mods and flags (bool), paths (str) and window (int) values. Mods keep their own
+        settings of any type in `types` under settings/<mod>/. Every change marks its section dirty and (re)schedules
+        one save after `delay` ms through `after`, or saves right away without it. Saves write a .part file and move
+        it into place, so a crash never leaves a truncated config. Unknown elements are written back as read.
+        """
+
+        schema = OrderedDict([('mods', bool), ('flags', bool), ('paths', str), ('window', int)])
+        types = OrderedDict([('bool', bool), ('int', int), ('float', float), ('str', str)])
+
+        def __init__(self, file, after=None, after_cancel=None, delay=500):
+            self.file = file
+            self.after = after  # E.g. Tk.after, the store must then only be changed from the Tk thread
+            self.after_cancel = after_cancel
+            self.delay = delay
+            self.sections = OrderedDict((section, OrderedDict()) for section in self.schema)
+            self.settings = OrderedDict()  # Per mod: key: value
+            self.extra = []  # Elements outside the schema
+            self.dirty = set()  # Sections changed since the last save
+            self.errors = []  # Values that did not fit the schema, left out
+            self.pending = None  # Scheduled save
+            self.saves = 0
+            self.__load()
+
+        def section(self, section):
+            return self.sections[section]
+
+        def get(self, section, key, default=None):
+            return self.sections[section].get(key, default)
+
+        def set(self, section, key, value):
+            """Change a value, schedules a save if it differs"""
+            value = self.schema[section](value)
+            if self.sections[section].get(key) != value or key not in self.sections[section]:
+                self.sections[section][key] = value
+                self.__changed(section)
+
+        def setting(self, mod, key, default=None):
+            """Setting of a mod"""
+            return self.settings.get(mod, {}).get(key, default)
+
+        def set_setting(self, mod, key, value):
+            """Change a setting of a mod, its type is kept in the file"""
+            if type(value).__name__ not in self.types:
+                raise TypeError('Mod settings are one of {}, not {}'.format(', '.join(self.types),
+                                                                             type(value).__name__))
+            settings = self.settings.setdefault(mod, OrderedDict())
+            if key not in settings or type(settings[key]) is not type(value) or settings[key] != value:
+                settings[key] = value
+                self.__changed('settings')
+
+        def save(self):
+            """Write the configuration if it changed, returns whether it was written"""
+            if self.pending is not None:
+                self.after_cancel(self.pending)
+                self.pending = None
+            if not self.dirty or self.file is None:
+                return False
+
+            root = ElementTree.Element('root')
+            for section, values in self.sections.items():
+                node = ElementTree.SubElement(root, section)
+                for key, value in values.items():
+                    ElementTree.SubElement(node, key).text = str(value)
+            if self.settings:
+                node = ElementTree.SubElement(root, 'settings')
+                for mod, settings in self.settings.items():
+                    mod_node = ElementTree.SubElement(node, mod)
+                    for key, value in settings.items():
+                        ElementTree.SubElement(mod_node, key, type=type(value).__name__).text = str(value)
+            root.extend(self.extra)
+            self.__indent(root)
+
+            part = self.file + '.part'
+            ElementTree.ElementTree(root).write(part, encoding='utf-8', xml_declaration=True)
+            os.replace(part, self.file)
+            self.dirty.clear()
+            self.saves += 1
+            return True
+
+        def __changed(self, section):
+            self.dirty.add(section)
+            if self.after is None:
+                self.save()
+                return
+            if self.pending is not None:
+                self.after_cancel(self.pending)
+            self.pending = self.after(self.delay, self.save)
+
+        def __load(self):
+            if self.file is None or not os.path.isfile(self.file):
+                return
+            try:
+                root = ElementTree.parse(self.file).getroot()
+            except (ElementTree.ParseError, OSError) as e:
+                self.errors.append(str(e))  # Starts from the defaults, the file is replaced on the next save
+                return
+
+            for node in root:
+                if node.tag in self.schema:
+                    for child in node:
+                        value = self.__parse(self.schema[node.tag], child.text)
+                        if value is None:
+                            self.errors.append('{}/{}={!r}'.format(node.tag, child.tag, child.text))
+                        else:
+                            self.sections[node.tag][child.tag] = value
+                elif node.tag == 'settings':
+                    for mod_node in node:
+                        settings = self.settings.setdefault(mod_node.tag, OrderedDict())
+                        for child in mod_node:
+                            typ = self.types.get(child.get('type', 'str'))
+                            value = None if typ is None else self.__parse(typ, child.text)
+                            if value is None:
+                                self.errors.append('settings/{}/{}={!r}'.format(mod_node.tag, child.tag, child.text))
+                            else:
+                                settings[child.tag] = value
+                else:
+                    self.extra.append(node)
+
+        @staticmethod
+        def __parse(typ, text):
+            """Value of an element's text, None if it does not fit the type"""
+            text = (text or '').strip()
+            if typ is bool:
+                return {'True': True, 'False': False}.get(text)
+            try:
+                return typ(float(text)) if typ is int else typ(text)
+            except ValueError:
+                return None
+
+        @classmethod
+        def __indent(cls, node, level=0):
+            """Indent elements with tabs, one per line"""
+            indent = '\n' + '\t' * level
+            if len(node):
+                if not node.text or not node.text.strip():
+                    node.text = indent + '\t'
+                for child in node:
+                    cls.__indent(child, level + 1)
+                    child.tail = indent + '\t'
+                child.tail = indent
+            if level == 0:
+                node.tail = '\n'
+
+    class LazyDict(dict):
+        """Dictionary that creates a missing value through a loader when it is first looked up"""
+
+        def __init__(self, loader):
+            super().__init__()
+            self.loader = loader
+
+        def __missing__(self, key):
+            value = self[key] = self.loader(key)
+            return value
+
     class Setting:
         # TODO: Define all program settings like this
         def __init__(self, nam, typ, val, default=None):
@@ -1233,9 +1909,19 @@ def taco_wrap(variables=None, settings=None):
         return decorator
 
 
+def startup_options(argv=None):
+    """TacoShell keyword arguments from the command line"""
+    parser = argparse.ArgumentParser(description='Start TacoShell')
+    parser.add_argument('--lazy-mods', action='store_true',
+                        help='Show the window first, import the enabled mods afterwards or when first used')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report the time spent per startup phase and mod import')
+    return vars(parser.parse_args(argv))
+
+
 def main():
     try:
-        obj = TacoShell()
+        obj = TacoShell(**startup_options())
         obj.start()
 
     except:
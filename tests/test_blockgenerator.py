@@ -0,0 +1,441 @@
+import os
+import json
+import pickle
+import sys
+import subprocess
+from io import StringIO
+
+import pytest
+
+from benchmarks.synthetic import make_workspace
+from mods.blockgenerator import BlockGenerator, Template, Definitions, OutputSink, TailSink, RelevanceFilter, \
+    Reporter, Stats, OpcWriter, DefinitionStore, MkzParser, TaglistBatch, main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SKIPPED = ('.fragments.json', 'generation_report.json')  # Differ between runs by design
+
+
+@pytest.fixture(scope='module')
+def workspace(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('workspace'))
+    files = make_workspace(path, 3000, nodes=4, seed=1)
+    with open(files['taglist'], 'a') as f:
+        f.write('"10_DMS_BAD";"tbad";"Malformed";"DMS"\n')
+    return files
+
+
+def generator_for(files, output, **options):
+    generator = BlockGenerator()
+    for key in ('code_path', 'opc_path', 'deviations_file', 'relevant_blocks_file', 'relevant_nodes_file'):
+        setattr(generator, key, files[key])
+    generator.output_path = os.path.join(output, '')
+    for key, value in options.items():
+        setattr(generator, key, value)
+    return generator
+
+
+def outputs(path):
+    contents = {}
+    for name in sorted(os.listdir(path)):
+        if name not in SKIPPED:
+            with open(os.path.join(path, name), 'rb') as f:
+                contents[name] = f.read()
+    return contents
+
+
+@pytest.fixture(scope='module')
+def baseline(workspace, tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('baseline'))
+    generator_for(workspace, output).generate_blocks(workspace['taglist'])
+    contents = outputs(output)
+    assert 'OpcProcessTags.XML' in contents and 'malformed_mkz.csv' in contents
+    assert len([name for name in contents if name.endswith('.LSE')]) == 4
+    return contents
+
+
+def test_command_line_without_tk(workspace, baseline, tmp_path):
+    code = ('import sys\n'
+            'sys.modules["tkinter"] = None\n'
+            'from mods import blockgenerator\n'
+            'assert "tacoshell" not in sys.modules\n'
+            'sys.exit(blockgenerator.main(sys.argv[1:]))\n')
+    subprocess.run([sys.executable, '-c', code, workspace['taglist'], '--out', str(tmp_path),
+                    '--code', workspace['code_path'], '--opc', workspace['opc_path'],
+                    '--deviations', workspace['deviations_file'],
+                    '--relevant-blocks', workspace['relevant_blocks_file'],
+                    '--relevant-nodes', workspace['relevant_nodes_file']], cwd=ROOT, check=True)
+    assert outputs(str(tmp_path)) == baseline
+
+
+def test_template_placeholders():
+    template = Template('P,1,{TAG};\nN,{NODE}.{NAME};{FOO} {b} {DESCRIPTION}  ')
+    assert template.unknown == ['FOO', 'b']
+    assert template.render('AS10', 't1', 'Pumpe', 'B1') == 'P,1,t1;\nN,AS10.B1;{FOO} {b} Pumpe\n'
+    assert Template('{ {} }').render('n', 't', 'd', 'b') == '{ {} }\n'
+
+
+def test_definitions_render_every_type():
+    definitions = Definitions({'DMS': 'T,{TAG};', 'VAL': 'V,{NAME};'})
+    assert sorted(definitions) == ['DMS', 'VAL']
+    assert definitions.template('VAL', 'B1').render('n', 't1', 'd', 'B1') == 'V,B1;\n'
+
+
+def test_output_sink_spills(tmp_path):
+    path = str(tmp_path / 'AS10.LSE')
+    sink = OutputSink(path, spill_size=8)
+    sink.write('P,1;\n')
+    assert sink.file is None and sink.size == 5
+    sink.write('P,2;\n')  # Spills
+    assert sink.chunks == [] and sink.size == 0 and sink.written == 10
+    assert os.path.isfile(path + '.part')
+
+
+def test_output_sink_discard(tmp_path):
+    path = str(tmp_path / 'AS10.LSE')
+    sink = OutputSink(path, spill_size=1)
+    sink.write('P,1;\n')
+    sink.discard()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_tail_sink():
+    tail = TailSink()
+    tail.append(('DMS', 'B1'))
+    tail.append(('VAL', 'B2'))
+    out = StringIO()
+    tail.drain_into(out)
+    assert out.getvalue() == 'ZYK,3;\nA,DMS,B1;\nE,XB,APPL;\nA,VAL,B2;\nE;\n'
+
+
+def test_relevance_filter_entries():
+    relevance = RelevanceFilter(['DMS\n', ' VAL ', '', 'M?T', '1[0-4]', 're:AN[AB]\\d*'])
+    assert relevance['DMS'] and relevance['VAL']
+    assert relevance['MOT'] and not relevance['MOTOR']
+    assert relevance['12'] and not relevance['15'] and not relevance['1']
+    assert relevance['ANA'] and relevance['ANB12'] and not relevance['ANA1X'] and not relevance['XANA']
+    assert not relevance['SPARE']
+    assert relevance == {'DMS': True, 'VAL': True, 'MOT': True, 'MOTOR': False, '12': True, '15': False, '1': False,
+                         'ANA': True, 'ANB12': True, 'ANA1X': False, 'XANA': False, 'SPARE': False}
+
+
+def test_relevance_filter_match_all():
+    assert RelevanceFilter(['*'])['anything']
+    assert not RelevanceFilter([])['anything']
+
+
+def test_sharded_matches_serial(workspace, baseline, tmp_path):
+    generator_for(workspace, str(tmp_path), workers=2, shard_size=500).generate_blocks(workspace['taglist'])
+    assert outputs(str(tmp_path)) == baseline
+
+
+class LogReporter(Reporter):
+    def __init__(self):
+        self.lines = []
+
+    def log(self, text, font='normal'):
+        self.lines.append(text)
+
+
+def test_incremental_matches_serial(workspace, baseline, tmp_path):
+    generator_for(workspace, str(tmp_path), incremental=True).generate_blocks(workspace['taglist'])
+    assert outputs(str(tmp_path)) == baseline
+
+    reporter = LogReporter()
+    generator = generator_for(workspace, str(tmp_path), incremental=True)
+    generator.reporter = reporter
+    generator.generate_blocks(workspace['taglist'])
+    assert outputs(str(tmp_path)) == baseline
+    assert 'No changes since last run, outputs in {} are up to date'.format(generator.output_path) in reporter.lines
+
+
+def test_incremental_after_change_matches_serial(workspace, tmp_path):
+    taglist = str(tmp_path / 'taglist.csv')
+    with open(workspace['taglist']) as f:
+        lines = f.readlines()
+    with open(taglist, 'w') as f:
+        f.writelines(lines)
+    incremental = str(tmp_path / 'incremental')
+    generator_for(workspace, incremental, incremental=True, chunk_size=500).generate_blocks(taglist)
+
+    lines[10] = lines[10].replace('";"', '";"Changed ', 2)
+    with open(taglist, 'w') as f:
+        f.writelines(lines)
+    reporter = LogReporter()
+    generator = generator_for(workspace, incremental, incremental=True, chunk_size=500)
+    generator.reporter = reporter
+    generator.generate_blocks(taglist)
+    assert 'Took 6 of 7 chunks over from the last run' in reporter.lines
+
+    serial = str(tmp_path / 'serial')
+    generator_for(workspace, serial).generate_blocks(taglist)
+    assert outputs(incremental) == outputs(serial)
+
+
+def test_incremental_rerenders_changed_definitions(workspace, baseline, tmp_path):
+    incremental = str(tmp_path / 'incremental')
+    generator_for(workspace, incremental, incremental=True).generate_blocks(workspace['taglist'])
+    code = os.path.join(workspace['code_path'], 'VAL.codedef')
+    with open(code) as f:
+        text = f.read()
+    try:
+        with open(code, 'w') as f:
+            f.write(text + 'X,{TAG};\n')
+        generator_for(workspace, incremental, incremental=True).generate_blocks(workspace['taglist'])
+        serial = str(tmp_path / 'serial')
+        generator_for(workspace, serial).generate_blocks(workspace['taglist'])
+        assert outputs(incremental) == outputs(serial) != baseline
+    finally:
+        with open(code, 'w') as f:
+            f.write(text)
+
+
+def test_definitions_deviations():
+    deviations = [['*', 'DMS', 'P,19,1;', 'P,19,2;'],
+                  [' B7 ', '*', 'P,19,1;', 'P,19,7;'],
+                  ['*', 'XXX', 'P,19,1;', 'P,19,3;'],
+                  ['too', 'short']]
+    definitions = Definitions({'DMS': 'P,19,1;\nT,{TAG};', 'VAL': 'P,19,1;'}, deviations)
+    assert definitions['DMS'].render('n', 't1', 'd', 'b') == 'P,19,2;\nT,t1;\n'
+    assert definitions['VAL'].text == 'P,19,1;'
+    assert definitions.template('DMS', 'B7').text == 'P,19,2;\nT,{TAG};'  # Already patched for every name
+    assert definitions.template('VAL', 'B7').text == 'P,19,7;'
+    assert definitions.template('VAL', 'B1') is definitions['VAL']
+    assert sorted(definitions.variants) == ['B7']
+    assert definitions.unmatched == [['*', 'XXX', 'P,19,1;', 'P,19,3;']]
+    assert definitions.malformed == [['too', 'short']]
+    assert len(list(definitions.templates())) == 4
+
+
+def test_definitions_repeated_deviation():
+    deviations = [['*', 'DMS', 'P,19,1;', 'P,19,1;P,20,1;'], ['*', ' DMS', 'P,19,1;', 'P,19,1;P,20,1;']]
+    definitions = Definitions({'DMS': 'P,19,1;'}, deviations)
+    assert definitions['DMS'].text == 'P,19,1;P,20,1;'
+    assert definitions.duplicates == [['*', 'DMS', 'P,19,1;', 'P,19,1;P,20,1;']]
+    assert definitions.unmatched == []
+
+
+def test_stats():
+    stats = Stats()
+    last = stats.lap('parse', stats.start)
+    stats.lap('render', last)
+    stats.merge({'render': 1.0})
+    stats.count('rows')
+    stats.count('rows', 2)
+    report = stats.report()
+    assert report['counters'] == {'rows': 3} and report['total'] > 0
+    assert report['stages']['render'] >= 1.0 and report['stages']['write'] == 0
+
+    lines = stats.summary()
+    assert lines[0].startswith('Run took') and lines[0].endswith(': 3 rows')
+    assert [line.split()[0] for line in lines[1:]] == ['render', 'parse']  # Slowest first, idle stages left out
+
+
+def test_instrumented_run_writes_report(workspace, baseline, tmp_path):
+    reporter = LogReporter()
+    generator = generator_for(workspace, str(tmp_path), instrument=True, reporter=reporter)
+    generator.generate_blocks(workspace['taglist'])
+    assert outputs(str(tmp_path)) == baseline
+    assert any(line.startswith('Run took') for line in reporter.lines)
+
+    with open(str(tmp_path / generator.report_file)) as f:
+        report = json.load(f)
+    assert report['counters']['rows'] == 3001 and report['counters']['nodes'] == 4
+    assert report['stages']['render'] > 0 and report['total'] >= sum(report['stages'].values())
+
+
+def test_plain_run_writes_no_report(workspace, tmp_path):
+    generator = generator_for(workspace, str(tmp_path))
+    generator.generate_blocks(workspace['taglist'])
+    assert generator.stats is None and not os.path.exists(str(tmp_path / generator.report_file))
+
+
+def test_opc_writer_check(tmp_path):
+    path = str(tmp_path / 'OpcProcessTags.XML')
+    opc = OpcWriter(path, header='<Tags>\n', footer='</Tags>\n', check=True)
+    opc.write('<Tag name="t1"/>\n')
+    assert opc.commit() == (len('<Tags>\n<Tag name="t1"/>\n</Tags>\n'), True)
+    assert opc.error is None
+
+    opc = OpcWriter(path, check=True)
+    opc.write('<Tag name="t1">\n')
+    opc.commit()
+    assert opc.error is not None and opc.error[0] == 2  # Unclosed tag, found at the end of the file
+
+
+def test_template_pickles_as_text():
+    template = pickle.loads(pickle.dumps(Template('T,{TAG};')))
+    assert template.render('n', 't1', 'd', 'b') == 'T,t1;\n'
+
+
+def test_definition_store_cache(tmp_path):
+    code = tmp_path / 'code'
+    code.mkdir()
+    (code / 'DMS.codedef').write_text('T,{TAG};\n')
+    (code / 'VAL.codedef').write_text('V,{TAG};\n')
+    cache = str(tmp_path / 'definitions.cache')
+
+    store = DefinitionStore(cache)
+    definitions = store.definitions(str(code), 'codedef')
+    assert store.definitions(str(code), 'codedef') is definitions
+    assert store.reads == 2
+    store.save()
+
+    store = DefinitionStore(cache)
+    assert store.definitions(str(code), 'codedef')['VAL'].render('n', 't1', 'd', 'b') == 'V,t1;\n'
+    assert store.reads == 0 and not store.changed
+
+    (code / 'VAL.codedef').write_text('V,{TAG},{NAME};\n')
+    assert store.definitions(str(code), 'codedef')['VAL'].render('n', 't1', 'd', 'b') == 'V,t1,b;\n'
+    assert store.reads == 1
+
+
+def test_definition_store_prunes_deleted_files(tmp_path):
+    code = tmp_path / 'code'
+    code.mkdir()
+    (code / 'DMS.codedef').write_text('T,{TAG};\n')
+    (code / 'VAL.codedef').write_text('V,{TAG};\n')
+    other = tmp_path / 'other'
+    other.mkdir()
+    (other / 'ANA.codedef').write_text('A,{TAG};\n')
+    cache = str(tmp_path / 'definitions.cache')
+
+    store = DefinitionStore(cache)
+    store.definitions(str(code), 'codedef')
+    store.definitions(str(other), 'codedef')
+    store.save()
+
+    (code / 'VAL.codedef').unlink()
+    assert sorted(store.definitions(str(code), 'codedef')) == ['DMS']
+    assert str(code / 'VAL.codedef') not in store.texts and len(store.texts) == 2
+
+    (other / 'ANA.codedef').unlink()
+    other.rmdir()
+    store = DefinitionStore(cache)
+    assert sorted(store.texts) == [str(code / 'DMS.codedef')] and len(store.compiled) == 1 and store.changed
+
+
+class Payload:
+    def __reduce__(self):
+        return os.system, ('exit 1',)
+
+
+@pytest.mark.parametrize('header', [b'', DefinitionStore.header + str(DefinitionStore.version).encode() + b'\n'])
+def test_definition_store_rejects_foreign_cache(tmp_path, header):
+    cache = tmp_path / 'definitions.cache'
+    cache.write_bytes(header + pickle.dumps({'texts': Payload(), 'compiled': {}}))
+    store = DefinitionStore(str(cache))
+    assert store.texts == {} and store.compiled == {}
+
+
+def test_mkz_parser_records():
+    mkz = MkzParser()
+    assert mkz.parse('10X1_DMS_B1') == ('10', '1', 'AS10', 'DMS', 'B1')
+    assert mkz.parse('10X1_VAL_B2', 2) == ('10', '1', 'AS10', 'VAL', 'B2')
+    assert list(mkz) == ['10X1']  # Bus nodes are split once
+    assert mkz.errors == []
+
+
+@pytest.mark.parametrize('value', ['10_DMS_B1', '10X1X2_DMS_B1', '10X1_DMS', '10X1_DMS_B1_C', ''])
+def test_mkz_parser_malformed(value):
+    mkz = MkzParser()
+    assert mkz.parse(value, 7) is None
+    assert mkz.errors == [(7, value)]
+
+
+def test_malformed_rows_listed(baseline):
+    lines = baseline['malformed_mkz.csv'].decode().splitlines()
+    assert lines == ['"Row";"MKZ"', '"3001";"10_DMS_BAD"']  # Rows counted from the first below the header
+
+
+def write_taglist(path, lines):
+    with open(str(path), 'w') as f:
+        f.write(''.join(';'.join('"{}"'.format(value) for value in line) + '\n' for line in lines))
+    return str(path)
+
+
+def test_taglist_batch(tmp_path):
+    first = write_taglist(tmp_path / 'a.csv', [('MKZ', 'TAG', 'DESC', 'PSRV', 'BLOCK'),
+                                               ('10X1_DMS_B1', 't1', 'Pumpe', 'DMS', 'DMS'),
+                                               ('10X1_VAL_B2', 't2', 'Ventil', 'VAL', 'VAL')])
+    second = write_taglist(tmp_path / 'b.csv', [('BLOCK', 'TAG', 'MKZ', 'PSRV'),
+                                                ('DMS', 'T1 ', '10x1_dms_b1', 'DMS'),  # t1 again
+                                                ('ANA', 't3', '10X1_ANA_B3', 'ANA')])
+    third = write_taglist(tmp_path / 'c.csv', [('MKZ', 'TAG', 'DESC', 'PSRV', 'BLOCK'),
+                                               ('10X1_ANA_B3', 't3', 'Analog', 'ANA', 'ANA'),
+                                               ('10X1_MOT_B4', 't4', 'Motor', 'MOT', 'MOT'),
+                                               ('10X1_MOT_B4', 't4', 'Motor', 'MOT', 'MOT')])  # Same taglist, kept
+
+    with TaglistBatch([first, second, third]) as batch:
+        rows = list(batch)
+        assert batch.offset == batch.size and batch.lines == 10
+    assert rows == [['MKZ', 'TAG', 'DESC', 'PSRV', 'BLOCK'],
+                    ['10X1_DMS_B1', 't1', 'Pumpe', 'DMS', 'DMS'],
+                    ['10X1_VAL_B2', 't2', 'Ventil', 'VAL', 'VAL'],
+                    ['10X1_ANA_B3', 't3', '', 'ANA', 'ANA'],  # Reordered to the first header
+                    ['10X1_MOT_B4', 't4', 'Motor', 'MOT', 'MOT'],
+                    ['10X1_MOT_B4', 't4', 'Motor', 'MOT', 'MOT']]
+    assert batch.duplicates == 2
+
+
+def test_taglist_batch_missing_column(tmp_path):
+    first = write_taglist(tmp_path / 'a.csv', [('MKZ', 'TAG', 'PSRV', 'BLOCK')])
+    second = write_taglist(tmp_path / 'b.csv', [('MKZ', 'TAG'), ('10X1_DMS_B1', 't1')])
+    with pytest.raises(ValueError, match='has no PSRV, BLOCK column'):
+        TaglistBatch([first, second])
+
+
+def test_output_sink_commit(tmp_path):
+    path = str(tmp_path / 'AS10.LSE')
+    sink = OutputSink(path, spill_size=4)
+    sink.write('P,1;\n')  # Spills
+    assert os.path.isfile(path + '.part') and not os.path.exists(path)
+    tail = TailSink()
+    tail.append(('DMS', 'B1'))
+    assert sink.commit(tail) == (len('P,1;\nZYK,3;\nA,DMS,B1;\nE,XB,APPL;\n'), True)
+    assert not os.path.exists(path + '.part')
+    with open(path) as f:
+        assert f.read() == 'P,1;\nZYK,3;\nA,DMS,B1;\nE,XB,APPL;\n'
+
+
+def test_output_sink_keeps_identical_file(tmp_path):
+    path = str(tmp_path / 'AS10.LSE')
+    with open(path, 'w') as f:
+        f.write('P,1;\n')
+    os.utime(path, ns=(10 ** 9, 10 ** 9))
+
+    sink = OutputSink(path)
+    sink.write('P,1;\n')
+    assert sink.commit() == (5, False)
+    assert os.stat(path).st_mtime_ns == 10 ** 9 and not os.path.exists(path + '.part')
+
+    sink = OutputSink(path)
+    sink.write('P,2;\n')
+    assert sink.commit() == (5, True)
+    assert os.stat(path).st_mtime_ns != 10 ** 9
+
+
+@pytest.mark.parametrize('option, value', [('--writers', '0'), ('--writers', '-2'), ('--shard-size', '0'),
+                                           ('-j', '-1'), ('--writers', 'many')])
+def test_command_line_rejects_counts(tmp_path, capsys, option, value):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['taglist.csv', '--out', str(tmp_path), option, value])
+    assert exit_info.value.code == 2 and os.listdir(str(tmp_path)) == []
+    assert 'argument {}'.format(option) in capsys.readouterr().err
+
+
+def test_scan_then_generate_matches_serial(workspace, baseline, tmp_path):
+    generator = generator_for(workspace, str(tmp_path))
+    index = generator.scan(workspace['taglist'])
+    assert generator.index is index and index.errors == [(3001, '10_DMS_BAD')]
+    assert sum(index.counts) == 3001 and sum(index.nodes.values()) == index.counts[0]
+    generator.generate_blocks(workspace['taglist'])
+    assert outputs(str(tmp_path)) == baseline
+
+
+def test_command_line_scan_then_generate(workspace, baseline, tmp_path):
+    assert main([workspace['taglist'], '--out', str(tmp_path), '--scan', '--generate',
+                 '--code', workspace['code_path'], '--opc', workspace['opc_path'],
+                 '--deviations', workspace['deviations_file'],
+                 '--relevant-blocks', workspace['relevant_blocks_file'],
+                 '--relevant-nodes', workspace['relevant_nodes_file']]) == 0
+    assert outputs(str(tmp_path)) == baseline
@@ -0,0 +1,88 @@
+import os
+import sys
+from importlib import import_module
+from time import time
+
+import pytest
+
+import mods
+from mozart import Mozart
+
+BASE_SOURCE = '''
+class Widget:
+    def value(self):
+        return {0}
+
+
+def answer():
+    return {0}
+'''
+
+USER_SOURCE = '''
+from mods.reload_base import answer
+
+
+def relay():
+    return answer()
+'''
+
+
+class Symphony:
+    """Stands in for the live TacoShell, holding the objects a reload migrates"""
+    def __init__(self, **components):
+        self.variables = {'children': {}}
+        self.components = components
+        self.log = []
+
+    def write_to_log(self, text, font='normal'):
+        self.log.append((text, font))
+
+
+def write_module(path, source, later):
+    """Write a module with a modification time after the last reload"""
+    path.write_text(source)
+    stamp = time() + later
+    os.utime(str(path), (stamp, stamp))
+
+
+@pytest.fixture
+def conductor(tmp_path, monkeypatch):
+    import_module('tacoshell')
+    monkeypatch.setattr(mods, '__path__', list(mods.__path__) + [str(tmp_path)])
+    write_module(tmp_path / 'reload_base.py', BASE_SOURCE.format(1), -60)
+    write_module(tmp_path / 'reload_user.py', USER_SOURCE, -60)
+    conductor = Mozart.__new__(Mozart)  # Without a window
+    conductor.mtimes = {}
+    conductor.checked = time()
+    yield conductor
+    for name in ('mods.reload_base', 'mods.reload_user'):
+        sys.modules.pop(name, None)
+
+
+def test_mreload_swaps_code_in_place(conductor, tmp_path):
+    base = import_module('mods.reload_base')
+    user = import_module('mods.reload_user')
+    widget = base.Widget()
+    callback = base.answer  # Held like a Tk callback
+    conductor.symphony = Symphony(widget=widget, widgets=[base.Widget()])
+
+    conductor.mreload()
+    assert conductor.symphony.log == [('Nothing changed since the last reload', 'normal')]
+
+    write_module(tmp_path / 'reload_base.py', BASE_SOURCE.format(2), 60)
+    conductor.mreload()
+    assert callback() == 2 and user.relay() == 2
+    assert type(widget) is base.Widget and widget.value() == 2  # Moved onto the new class
+    assert type(conductor.symphony.components['widgets'][0]) is base.Widget
+    assert conductor.symphony.log[-1][0].startswith('Reloaded mods.reload_base, mods.reload_user in ')
+
+
+def test_mreload_keeps_code_after_error(conductor, tmp_path):
+    base = import_module('mods.reload_base')
+    widget = base.Widget()
+    conductor.symphony = Symphony(widget=widget)
+
+    write_module(tmp_path / 'reload_base.py', 'def answer(:\n', 60)
+    conductor.mreload()
+    assert base.answer() == 1 and widget.value() == 1
+    assert conductor.symphony.log == [('Reloading mods.reload_base failed, kept the previous code', 'bad')]
@@ -0,0 +1,94 @@
+import pytest
+
+from tacofiles import CsvStream, MappedCsv, interpret_file, LineIndex
+
+
+def test_csv_stream(tmp_path):
+    file = tmp_path / 'taglist.csv'
+    file.write_bytes(b'@Comment\n"MKZ";"TAG"\n\n  "10X1_DMS_B1";"t1"\r\n@Comment\n"10X1_DMS_B2";"t;2"')
+    stream = CsvStream(str(file), ';', '"')
+    assert stream.offset == 0
+    assert next(stream) == ['MKZ', 'TAG']
+    assert list(stream) == [['10X1_DMS_B1', 't1'], ['10X1_DMS_B2', 't;2']]
+    assert stream.offset == stream.size == file.stat().st_size
+    assert stream.lines == 6
+
+
+def test_csv_stream_without_quotes(tmp_path):
+    file = tmp_path / 'relevant.csv'
+    file.write_text('a;"b"\n')
+    assert list(CsvStream(str(file), ';')) == [['a', '"b"']]
+
+
+def test_csv_stream_close(tmp_path):
+    file = tmp_path / 'taglist.csv'
+    file.write_text('a;b\nc;d\n')
+    with CsvStream(str(file), ';') as stream:
+        assert next(stream) == ['a', 'b']
+    assert stream.offset < stream.size
+    with pytest.raises(StopIteration):
+        next(stream)
+
+
+def test_interpret_file(tmp_path):
+    file = tmp_path / 'deviations.csv'
+    file.write_text('@"Key"; "Value"\n"a"; "1"\n"b"; "2"\n')
+    stream, size = interpret_file(str(file), ';', '"')
+    assert size == file.stat().st_size and list(stream) == [['a', '1'], ['b', '2']]
+    assert interpret_file(str(file), ';', '"', buffermode='list') == ([['a', '1'], ['b', '2']], 3)
+    assert interpret_file(str(file), ';', '"', buffermode='dict') == ({'a': '1', 'b': '2'}, 3)
+
+
+def test_mapped_csv(tmp_path):
+    file = tmp_path / 'taglist.csv'
+    file.write_bytes(b'@Comment\n"MKZ";"TAG"\n\n"10X1_DMS_B1";"t1"\n@Comment\n'
+                     b'  "10X1_DMS_B2";"t2"\r\n"10X1_DMS_B3";"t3"')
+    with MappedCsv(str(file), delimiter=';', quotechar='"') as taglist:
+        assert len(taglist) == 4
+        assert next(taglist) == ['MKZ', 'TAG']
+        begin, end = taglist.span(1, 3)
+        assert list(taglist.parse(begin, end)) == [['10X1_DMS_B1', 't1'], ['10X1_DMS_B2', 't2']]
+        assert taglist.span(3) == (taglist.lines[3], taglist.size)
+        assert list(taglist.read(1, chunk=2)) == [['10X1_DMS_B1', 't1'], ['10X1_DMS_B2', 't2'],
+                                                   ['10X1_DMS_B3', 't3']]
+        assert taglist.offset == taglist.size
+    assert taglist.map == b''  # Unmapped on close
+    with pytest.raises(StopIteration):
+        next(taglist)
+
+
+def test_mapped_csv_empty(tmp_path):
+    file = tmp_path / 'taglist.csv'
+    file.write_bytes(b'')
+    with MappedCsv(str(file), delimiter=';') as taglist:
+        assert len(taglist) == 0 and list(taglist) == []
+
+
+def test_line_index(tmp_path):
+    file = tmp_path / 'big.txt'
+    file.write_bytes(b'first\n\nthird\r\nfourth\nlast')
+    index = LineIndex(str(file))
+    assert not index.extend(8) and list(index.lines) == [0, 6, 7]
+    assert index.line(3) == 0 and index.line(20) is None  # Not indexed yet
+    assert not index.extend(8) and index.extend(100) and list(index.lines) == [0, 6, 7, 14, 21]
+    assert index.line(20) == 3 and index.line(index.size - 1) == 4
+
+    assert index.start(10) == 7 and index.start(0) == 0
+    assert index.forward(0, 2) == 7 and index.forward(14, 5) == index.size
+    assert index.backward(21, 3) == 6 and index.backward(6, 5) == 0
+    assert index.starts(6, 21) == [6, 7, 14] and index.starts(21, index.size) == [21]
+    assert index.text(7, 14) == 'third\r\n'
+    index.close()
+    assert index.map == b''
+
+
+def test_line_index_trailing_newline(tmp_path):
+    file = tmp_path / 'big.txt'
+    file.write_bytes(b'a\nb\n')
+    with LineIndex(str(file)) as index:
+        assert index.extend() and list(index.lines) == [0, 2]  # No line after the last newline
+        assert index.starts(0, 4) == [0, 2]
+
+    file.write_bytes(b'')
+    with LineIndex(str(file)) as index:
+        assert index.extend() and list(index.lines) == [0] and index.starts(0, 0) == [0]
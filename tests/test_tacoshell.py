@@ -0,0 +1,461 @@
+import os
+import threading
+import py_compile
+import zipfile
+from collections import OrderedDict
+from queue import Queue
+
+import pytest
+
+from tacoshell import TacoShell
+
+ConfigStore = TacoShell.ConfigStore
+ModRegistry = TacoShell.ModRegistry
+
+MOD_SOURCE = '''
+class Mod:
+    def eat_taco(self, parent, child_id):
+        parent.components['btn_generate_command'] = self.generate
+        parent.root_window.title("{}")
+
+
+def make_taco():
+    return Mod()
+'''
+
+
+class FakeRoot:
+    """Stands in for the Tk root window, after() callbacks only run when the test calls run_after"""
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.delays = []
+        self.updates = 0
+        self.count = 0
+
+    def after(self, ms, callback):
+        self.count += 1
+        after_id = 'after#{}'.format(self.count)
+        self.pending[after_id] = callback
+        self.delays.append(ms)
+        return after_id
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+    def run_after(self):
+        while self.pending:
+            self.pending.popitem(last=False)[1]()
+
+    def update(self):
+        self.updates += 1
+
+
+class FakeWidget:
+    """Records its options like a Tk widget"""
+    def __init__(self, **options):
+        self.options = options
+        self.history = []
+
+    def configure(self, **options):
+        self.options.update(options)
+        self.history.append(options)
+
+    config = configure
+
+    def __getitem__(self, key):
+        return self.options.get(key, 0)
+
+    def __setitem__(self, key, value):
+        self.configure(**{key: value})
+
+
+class FakeText(FakeWidget):
+    def __init__(self):
+        super().__init__()
+        self.inserts = []
+
+    def insert(self, index, *chunks):
+        self.inserts.append(chunks)
+
+    def delete(self, first, last=None):
+        del self.inserts[:]
+
+    def yview_moveto(self, fraction):
+        pass
+
+
+class FakeVar:
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+@pytest.fixture
+def shell():
+    """A TacoShell without a display, holding only what commands, progress and the log use"""
+    shell = TacoShell(init=False)
+    shell.root_window = FakeRoot()
+    shell.variables = {'DEBUG_MODE': FakeVar(False), 'OVERRIDE': False, 'is_processing': False,
+                       'progress_update_cycle': 1 / 10, 'log_flush_cycle': 100, 'log_queue': [],
+                       'log_flush_id': None, 'muted_counters': OrderedDict(), 'worker_queue': Queue(),
+                       'command_inputs': {}, 'worker_poll_id': None, 'worker_poll_limit': 500}
+    shell.components = {'txt_log': FakeText(), 'btn_stop': FakeWidget(), 'btn_generate': FakeWidget(),
+                        'lbl_progress': FakeWidget(), 'bar_progress': FakeWidget(maximum=100, value=0),
+                        'entry_path': FakeVar('taglist.csv'), 'var_estimated_time_remaining': FakeVar(),
+                        'STOP_COMMAND': False, 'count_failed': 0, 'progress_value': 0, 'progress_maximum': 0,
+                        'progress_force': False, 'start_time': 0, 'last_update': 0}
+    return shell
+
+
+def test_write_to_log_batches(shell):
+    shell.write_to_log('first', timestamp=False)
+    shell.write_to_log('second', 'bad')
+    shell.write_to_log('third', 'muted')
+    txt = shell.components['txt_log']
+    assert txt.inserts == [] and len(shell.root_window.pending) == 1  # One flush scheduled for all
+
+    shell.root_window.run_after()
+    assert txt.inserts == [('first\n', 'normal', 'second\n', 'bad', 'third\n', 'muted')]
+    assert shell.variables['log_queue'] == [] and shell.variables['log_flush_id'] is None
+
+    shell.flush_log()
+    assert len(txt.inserts) == 1
+
+
+def test_write_to_log_timestamps_normal_text(shell):
+    shell.write_to_log('done', 'good')
+    shell.flush_log()
+    stamp, font, text, text_font = shell.components['txt_log'].inserts[0]
+    assert stamp.endswith(':\t') and font == 'highlighted'
+    assert (text, text_font) == ('done\n', 'good')
+
+
+def test_flush_log_cancels_scheduled_flush(shell):
+    shell.write_to_log('now')
+    shell.flush_log()
+    assert shell.root_window.pending == {} and len(shell.components['txt_log'].inserts) == 1
+
+
+def test_write_to_log_from_worker(shell):
+    worker = threading.Thread(target=shell.write_to_log, args=('from worker', 'bad'))
+    worker.start()
+    worker.join()
+    assert shell.variables['log_queue'] == []
+    assert shell.variables['worker_queue'].get_nowait() == ('log', 'from worker', 'bad', True)
+
+
+def test_muted_counters(shell):
+    shell.variables['is_processing'] = True
+    for text in ('Skipped row', 'Skipped row', 'Unknown type', 'Skipped row'):
+        shell.write_to_log(text, 'muted')
+    assert shell.variables['log_queue'] == [] and shell.root_window.pending == {}
+
+    shell._TacoShell__summarize_muted()
+    assert shell.variables['log_queue'] == ['Skipped row (3x)\n', 'muted', 'Unknown type\n', 'muted']
+    assert shell.variables['muted_counters'] == {}
+
+
+def test_muted_outside_processing(shell):
+    shell.write_to_log('Idle', 'muted')
+    assert shell.variables['log_queue'] == ['Idle\n', 'muted'] and shell.variables['muted_counters'] == {}
+
+
+def run_until_finished(shell):
+    while shell.variables['is_processing']:
+        shell.root_window.run_after()
+
+
+def logged(shell):
+    return [chunk for chunks in shell.components['txt_log'].inserts for chunk in chunks[::2]]
+
+
+def test_run_command_on_worker(shell):
+    threads = []
+
+    def command():
+        threads.append(threading.current_thread())
+        assert shell.variables['command_inputs']['entry_path'] == 'taglist.csv'
+        shell.write_to_log('Working', timestamp=False)
+        shell.update_progress(value=3, maximum=4)
+        return ['Summary']
+
+    shell.run_command(TacoShell.threaded(command))
+    run_until_finished(shell)
+    assert threads and threads[0] is not threading.main_thread()
+    assert shell.root_window.updates == 0  # The main loop repaints, not the worker
+    assert 'Working\n' in logged(shell) and 'Summary\n' in logged(shell)
+    assert shell.components['bar_progress'].options == {'maximum': 4, 'value': 4}
+    assert shell.components['lbl_progress']['text'] == 'Completed'
+    assert shell.components['btn_generate']['state'] == 'normal'
+    assert shell.root_window.pending == {}
+
+
+def test_run_command_worker_error(shell):
+    def command():
+        raise ValueError('broken')
+
+    with pytest.raises(ValueError):  # Raised by whichever poll sees the worker finish
+        shell.run_command(TacoShell.threaded(command))
+        run_until_finished(shell)
+    assert shell.components['lbl_progress']['text'] == 'Error' and not shell.variables['is_processing']
+
+
+def test_run_command_on_main_thread_repaints(shell):
+    seen = []
+
+    def command():
+        shell.update_progress(value=1, maximum=2, force=True)
+        seen.append((shell.root_window.updates, dict(shell.components['bar_progress'].options)))
+
+    shell.run_command(command)
+    assert seen == [(1, {'maximum': 2, 'value': 1})]
+    assert not shell.variables['is_processing']
+
+
+def test_run_command_without_progress_keeps_bar(shell):
+    shell.components['bar_progress'] = bar = FakeWidget(maximum=10, value=4)
+    shell.run_command(TacoShell.threaded(lambda: None))
+    run_until_finished(shell)
+    assert bar.history == [] and shell.components['lbl_progress']['text'] == 'Completed'
+
+
+def test_poll_worker_limit(shell):
+    shell.variables['worker_poll_limit'] = 2
+    shell.variables['is_processing'] = True
+    for i in range(5):
+        shell.variables['worker_queue'].put(('log', str(i), 'normal', False))
+    shell._TacoShell__poll_worker()
+    assert shell.variables['worker_queue'].qsize() == 3
+    assert logged(shell) == ['0\n', '1\n'] and shell.root_window.delays[-1] == 1
+
+
+class FakeScrolledText:
+    """
+    Stands in for a ScrollableText showing `rows` lines from `top`. Like Tk, the content ends in a newline of its
+    own, and moving the view calls yscrollcommand.
+    """
+    def __init__(self, rows=10):
+        self.content = ''
+        self.rows = rows
+        self.top = 0
+        self.options = {}
+        self.scrollbar_vert = FakeWidget()
+        self.scrollbar_vert.set = lambda lo, hi: self.scrollbar_vert.configure(lo=lo, hi=hi)
+        self.idle = []
+
+    def lines(self):
+        return self.content.split('\n')
+
+    def configure(self, **options):
+        self.options.update(options)
+
+    def insert(self, index, text):
+        self.content = text + self.content if index == '1.0' else self.content + text
+
+    def delete(self, first, last):
+        lines = self.lines()
+        if last == 'end':
+            self.content = ''
+        elif first == '1.0':
+            self.content = '\n'.join(lines[int(last.split('.')[0]) - 1:])
+        else:
+            self.content = ''.join(line + '\n' for line in lines[:int(first.split('.')[0]) - 1])
+
+    def index(self, index):
+        y = int(index.split(',')[1])
+        line = self.top + (self.rows - 1 if y else 0)
+        return '{}.0'.format(min(line, len(self.lines()) - 1) + 1)
+
+    def yview(self, *args):
+        if args[0] == 'scroll':
+            self.top += int(args[1])
+        else:
+            self.top = int(args[0].split('.')[0]) - 1
+        self.top = max(0, min(self.top, len(self.lines()) - 1))
+        self.options['yscrollcommand'](0.0, 1.0)
+
+    def winfo_height(self):
+        return 100
+
+    def winfo_exists(self):
+        return True
+
+    def bind(self, sequence, callback, add=None):
+        pass
+
+    def after_idle(self, callback):
+        self.idle.append(callback)
+
+    def after(self, ms, callback):
+        self.idle.append(callback)
+
+    def run_idle(self):
+        while self.idle:
+            self.idle.pop(0)()
+
+    def shown(self):
+        return self.lines()[self.top]
+
+
+@pytest.fixture
+def paged(tmp_path):
+    file = tmp_path / 'big.txt'
+    file.write_text(''.join('line {}\n'.format(number) for number in range(1, 5001)))
+    text = FakeScrolledText()
+    status = FakeWidget()
+    view = TacoShell.PagedText(text, str(file), status=status, page=20, keep=3)
+    yield view, text, status
+    view.index.close()
+
+
+def loaded(view):
+    """Lines held by the view, as read from the file"""
+    return view.index.text(view.begin, view.end).split('\n')[:-1]
+
+
+def test_paged_text_scrolls_through_pages(paged):
+    view, text, status = paged
+    assert text.lines()[:-1] == ['line {}'.format(number) for number in range(1, 41)]
+
+    for number in range(2, 301):
+        text.yview('scroll', 1, 'units')
+        assert text.shown() == 'line {}'.format(number)
+        assert text.lines()[:-1] == loaded(view) and len(view.starts) <= 60
+    assert view.begin > 0
+
+    for number in range(299, 0, -1):
+        text.yview('scroll', -1, 'units')
+        assert text.shown() == 'line {}'.format(number)
+        assert text.lines()[:-1] == loaded(view) and len(view.starts) <= 60
+
+
+def test_paged_text_jumps_and_counts_lines(paged):
+    view, text, status = paged
+    text.yview('scroll', 0, 'units')
+    assert status['text'] == 'read-only, line ? of 1+'  # Not indexed yet
+    text.run_idle()
+    assert view.index.complete
+
+    view.yview('moveto', '0.5')
+    number = int(text.shown().split()[1])
+    assert 2400 < number < 2600 and text.lines()[:-1] == loaded(view)
+    assert status['text'] == 'read-only, line {:,} of 5,000'.format(number)
+
+
+def write_mods(path):
+    path.mkdir()
+    (path / 'alpha.py').write_text(MOD_SOURCE.format('Alpha'))
+    (path / 'beta.py').write_text(MOD_SOURCE.format('Beta'))
+    py_compile.compile(str(path / 'beta.py'), cfile=str(path / 'beta.pyc'))  # The source takes precedence
+    (path / '_helper.py').write_text('')
+    (path / 'notes.txt').write_text('')
+    with zipfile.ZipFile(str(path / 'gamma.zip'), 'w') as bundle:
+        bundle.writestr('gamma.py', MOD_SOURCE.format('Gamma'))
+
+
+def test_mod_registry_refresh(tmp_path):
+    path = tmp_path / 'tmods'
+    write_mods(path)
+    manifest = str(tmp_path / 'mod_manifest.json')
+
+    registry = ModRegistry(str(path), manifest)
+    assert registry.refresh() == ['alpha', 'beta', 'gamma']
+    assert registry.hashed == 3
+    assert [registry[name]['kind'] for name in registry] == ['py', 'py', 'zip']
+    assert registry['gamma']['title'] == 'Gamma'
+    assert registry['alpha']['components'] == ['btn_generate_command']
+    assert registry['alpha']['entry'] == 'make_taco'
+
+    registry = ModRegistry(str(path), manifest)  # Listed from the manifest, nothing read
+    assert registry.refresh() == [] and registry.hashed == 0
+    assert list(registry) == ['alpha', 'beta', 'gamma']
+
+    (path / 'beta.py').unlink()
+    assert registry.refresh() == [] and registry['beta']['kind'] == 'pyc'
+    assert registry['beta']['title'] is None  # Nothing to read it from
+
+
+def test_mod_registry_learn(tmp_path):
+    path = tmp_path / 'tmods'
+    write_mods(path)
+    manifest = str(tmp_path / 'mod_manifest.json')
+    registry = ModRegistry(str(path), manifest)
+    registry.refresh()
+    registry.learn('gamma', 'Gamma mod', ['frame_extra'])
+    assert ModRegistry(str(path), manifest)['gamma']['title'] == 'Gamma mod'
+
+
+def test_mod_registry_inspect():
+    assert ModRegistry.inspect(MOD_SOURCE.format('Alpha')) == {'entry': 'make_taco', 'title': 'Alpha',
+                                                               'components': ['btn_generate_command']}
+    assert ModRegistry.inspect('def other():\n    pass\n') == {'entry': None, 'title': None, 'components': []}
+    assert ModRegistry.inspect('def broken(:\n') == {}
+
+
+def test_config_store_round_trip(tmp_path):
+    file = str(tmp_path / 'config.xml')
+    config = ConfigStore(file)
+    config.set('flags', 'DEBUG_MODE', 1)
+    config.set('paths', 'entry_path', 'taglist.csv')
+    config.set('window', 'width', '640')
+    config.set_setting('blockgenerator', 'workers', 4)
+    config.set_setting('blockgenerator', 'ratio', 0.5)
+    config.set_setting('blockgenerator', 'name', '4')
+    config.set_setting('blockgenerator', 'check', False)
+    assert config.saves == 7 and not os.path.exists(file + '.part')
+
+    config = ConfigStore(file)
+    assert config.errors == []
+    assert config.get('flags', 'DEBUG_MODE') is True
+    assert config.get('paths', 'entry_path') == 'taglist.csv'
+    assert config.get('window', 'width') == 640
+    assert config.get('window', 'height', 480) == 480
+    settings = [config.setting('blockgenerator', key) for key in ('workers', 'ratio', 'name', 'check')]
+    assert settings == [4, 0.5, '4', False]
+    assert [type(value) for value in settings] == [int, float, str, bool]
+
+
+def test_config_store_saves_changes_only(tmp_path):
+    config = ConfigStore(str(tmp_path / 'config.xml'))
+    config.set('mods', 'blockgenerator', True)
+    config.set('mods', 'blockgenerator', True)
+    config.set_setting('blockgenerator', 'workers', 1)
+    config.set_setting('blockgenerator', 'workers', True)  # Same value, other type
+    assert config.saves == 3
+    with pytest.raises(TypeError):
+        config.set_setting('blockgenerator', 'nodes', [1, 2])
+
+
+def test_config_store_scheduled_save(tmp_path):
+    scheduled = []
+    config = ConfigStore(str(tmp_path / 'config.xml'), after=lambda delay, save: scheduled.append(save) or
+                         len(scheduled), after_cancel=lambda pending: None)
+    config.set('flags', 'OVERRIDE', False)
+    config.set('paths', 'entry_path', 'a.csv')
+    assert config.saves == 0 and config.dirty == {'flags', 'paths'}
+    assert scheduled[-1]() and config.saves == 1
+
+
+def test_config_store_in_memory():
+    config = ConfigStore(None)
+    config.set('flags', 'OVERRIDE', True)
+    assert config.get('flags', 'OVERRIDE') is True
+    assert not config.save() and config.saves == 0
+
+
+def test_config_store_recovers(tmp_path):
+    file = tmp_path / 'config.xml'
+    file.write_text('<root><flags><A>maybe</A><B>True</B></flags><theme><dark>1</dark></theme>')
+    config = ConfigStore(str(file))
+    assert len(config.errors) == 1 and config.get('flags', 'B') is None  # Not well-formed
+
+    file.write_text('<root><flags><A>maybe</A><B>True</B></flags><theme><dark>1</dark></theme></root>')
+    config = ConfigStore(str(file))
+    assert config.errors == ["flags/A='maybe'"] and config.get('flags', 'B') is True
+    config.set('flags', 'C', False)
+    assert '<theme>' in file.read_text()  # Unknown elements are written back